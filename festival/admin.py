@@ -1,20 +1,25 @@
-import base64
-from io import BytesIO
+import csv
 
 from django.contrib import admin, messages
-from django.core.files.uploadedfile import InMemoryUploadedFile
-
+from django.contrib.admin.views.main import ChangeList
+from django.core.exceptions import PermissionDenied
+from django.db.models.functions import Substr
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.shortcuts import redirect
+from django.template.response import TemplateResponse
+from django.urls import path
+
+from import_export import resources
 from import_export.admin import ImportExportModelAdmin
 
-from . import models, forms
+from . import caching, exports, mailer, models, forms, ranking
 
 
 def make_assign_to_gallery(year):
     def assign_to_gallery(modeladmin, request, queryset):
-        for photo in queryset:
-            changed = photo.assign_to(year)
-            if changed:
-                messages.info(request, f'Fotka { photo.name } zařazena do galerie { year }')
+        count = models.Photo.assign(queryset, year)
+        if count:
+            messages.info(request, f'Do galerie { year } zařazeno { count } fotek.')
 
     assign_to_gallery.short_description = f'Zařadit do galerie { year }'
     assign_to_gallery.__name__ = f'assign_to_gallery_{ year.id }'
@@ -22,14 +27,37 @@ def make_assign_to_gallery(year):
     return assign_to_gallery
 
 
+class ProjectedChangeList(ChangeList):
+    def get_queryset(self, request):
+        return self.model_admin.get_changelist_queryset(super().get_queryset(request))
+
+
+class ProjectedChangeListMixin:
+    list_defer = []
+
+    def get_changelist(self, request, **kwargs):
+        return ProjectedChangeList
+
+    def get_changelist_queryset(self, queryset):
+        if self.list_defer:
+            queryset = queryset.defer(*self.list_defer)
+        return queryset
+
+
+ARTICLE_TEXT_FIELDS = ['full_text', 'full_text_en']
+FILM_TEXT_FIELDS = ['description', 'starring', 'others', 'film_password', 'subtitles_password', 'trailer_password']
+
+
 class PublishMixin:
     actions = ['publish', 'hide']
 
     def publish(self, request, queryset):
         queryset.update(published=True)
+        caching.invalidate_section_list()
 
     def hide(self, request, queryset):
         queryset.update(published=False)
+        caching.invalidate_section_list()
 
     publish.short_description = 'Publikovat'
     hide.short_description = 'Skrýt'
@@ -42,13 +70,15 @@ class YearAdmin(admin.ModelAdmin):
 
 
 @admin.register(models.Article)
-class ArticleAdmin(PublishMixin, admin.ModelAdmin):
+class ArticleAdmin(ProjectedChangeListMixin, PublishMixin, admin.ModelAdmin):
     model = models.Article
+    list_defer = ARTICLE_TEXT_FIELDS
 
 
 @admin.register(models.Section)
-class SectionAdmin(PublishMixin, admin.ModelAdmin):
+class SectionAdmin(ProjectedChangeListMixin, PublishMixin, admin.ModelAdmin):
     model = models.Section
+    list_defer = ARTICLE_TEXT_FIELDS + ['extra_full_text', 'extra_full_text_en']
     list_display = ['__str__', 'role', 'order', 'published', 'widget', 'max_columns']
     list_filter = ['role', 'published']
     fieldsets = (
@@ -88,18 +118,20 @@ class GalleryAdmin(admin.ModelAdmin):
 
     def save_model(self, request, obj, form, change):
         super().save_model(request, obj, form, change)
-        photo_list = dict(form.files).get('photo_list', [])
-        for photo in photo_list:
-            models.Photo.objects.create(original=photo, description=obj.get_year(), year=obj)
+        photo_list = form.files.getlist('photo_list')
+        if photo_list:
+            models.Photo.ingest(photo_list, obj)
 
 
 @admin.register(models.Photo)
-class PhotoAdmin(admin.ModelAdmin):
+class PhotoAdmin(ProjectedChangeListMixin, admin.ModelAdmin):
     list_display = ['id', '__str__', 'year', 'order']
+    list_select_related = ['year']
+    list_defer = ['description_en', 'previous_slug', 'next_slug']
     list_display_links = ['__str__']
     list_filter = ['year']
     form = forms.PhotoAdminForm
-    actions = ['unassign']
+    actions = ['unassign', 'renumber']
     readonly_fields = ['get_img_url']
 
     def get_img_url(self, obj):
@@ -108,34 +140,34 @@ class PhotoAdmin(admin.ModelAdmin):
     get_img_url.short_description = "url fotky"
 
     def unassign(self, request, queryset):
-        for photo in queryset:
-            if photo.year:
-                messages.info(request, f'Fotka { photo } vyřazena z galerie { photo.year }')
-        queryset.update(year=None)
+        count = models.Photo.assign(queryset, None)
+        if count:
+            messages.info(request, f'Z galerií vyřazeno { count } fotek.')
 
     unassign.short_description = "Vyřadit z galerie"
 
-    def get_actions(self, request):
-        actions = super().get_actions(request)
+    def renumber(self, request, queryset):
+        year_ids = set(queryset.exclude(year=None).order_by().values_list('year_id', flat=True).distinct())
+        count = models.Photo.renumber(year_ids)
+        messages.info(request, f'Pořadí { count } fotek v galeriích přečíslováno.')
+
+    renumber.short_description = "Přečíslovat pořadí v galeriích vybraných fotek"
 
-        for year in list(models.Year.objects.all()):
+    def get_assign_actions(self):
+        actions = {}
+        for year in models.Year.objects.all():
             action = make_assign_to_gallery(year)
             actions[action.__name__] = (action, action.__name__, action.short_description)
+        return actions
 
+    def get_actions(self, request):
+        actions = super().get_actions(request)
+        actions.update(caching.get_year_registry('photo_assign_actions', self.get_assign_actions))
         return actions
 
     def save_model(self, request, obj, form, change):
-        if 'cropped' in form.changed_data:
-            format, imgstr = request.POST['cropped'].split(';base64,')
-            ext = format.split('/')[-1]
-            file = BytesIO(base64.b64decode(imgstr))
-            image = InMemoryUploadedFile(file,
-                                         field_name='cropped',
-                                         name=str(obj.id) + ext,
-                                         content_type="image/jpeg",
-                                         size=len(file.getvalue()),
-                                         charset=None)
-            obj.cropped = image
+        if form.cleaned_data.get('cropped') and obj.original:
+            obj.crop(form.cleaned_data['cropped'])
         super().save_model(request, obj, form, change)
 
     class Media:
@@ -152,25 +184,124 @@ class ContactAdmin(admin.ModelAdmin):
     model = models.Contact
 
 
+class RatingListFilter(admin.SimpleListFilter):
+    title = 'průměrné hodnocení'
+    parameter_name = 'rating'
+
+    def lookups(self, request, model_admin):
+        return [('none', 'bez hodnocení')] + [(str(like), f'alespoň { label }') for like, label in reversed(models.Evaluation.LIKE_CHOICES[1:])]
+
+    def queryset(self, request, queryset):
+        if self.value() == 'none':
+            return queryset.filter(evaluation_count=0)
+        if self.value():
+            return queryset.filter(rating__gte=int(self.value()))
+        return queryset
+
+
+class FilmResource(resources.ModelResource):
+    class Meta:
+        model = models.Film
+        exclude = models.Film.RATING_FIELDS
+
+
 @admin.register(models.Film)
-class FilmAdmin(ImportExportModelAdmin):
+class FilmAdmin(ProjectedChangeListMixin, ImportExportModelAdmin):
     model = models.Film
-    list_display = ['__str__', 'year', 'time', 'category', 'genre', 'country', 'get_rating', 'status', 'technical_check']
-    list_filter = ['status', 'category', 'genre']
-    actions = ['send_unpaid_remainder',]
+    resource_class = FilmResource
+    list_defer = FILM_TEXT_FIELDS
+    list_display = ['__str__', 'year', 'time', 'category', 'genre', 'country', 'get_rating', 'evaluation_count',
+                    'technical_yes', 'technical_no', 'status', 'technical_check']
+    list_filter = ['status', 'category', 'genre', RatingListFilter]
+    actions = ['send_unpaid_remainder', 'mark_registered']
+    change_list_template = 'admin/festival/film/change_list.html'
+
+    def get_urls(self):
+        return [
+            path('ranking/', self.admin_site.admin_view(self.ranking_view), name='festival_film_ranking'),
+            path('export-stream/<str:format>/', self.admin_site.admin_view(self.export_stream_view),
+                 name='festival_film_export_stream'),
+            path('bulk-import/', self.admin_site.admin_view(self.bulk_import_view), name='festival_film_bulk_import'),
+        ] + super().get_urls()
+
+    def bulk_import_view(self, request):
+        if not self.has_add_permission(request):
+            raise PermissionDenied
+        form = forms.FilmBulkImportForm(request.POST or None, request.FILES or None)
+        errors = []
+        if request.method == 'POST' and form.is_valid():
+            films, errors = form.get_films()
+            if not errors and not form.errors:
+                films, emails = models.Film.bulk_import(films, notify=form.cleaned_data['notify'])
+                messages.info(request, f'Naimportováno { len(films) } filmů, do fronty zařazeno { len(emails) } notifikací.')
+                return redirect('admin:festival_film_changelist')
+        return TemplateResponse(request, 'admin/festival/film/bulk_import.html', dict(
+            self.admin_site.each_context(request),
+            opts=self.model._meta,
+            title='Hromadný import filmů',
+            form=form,
+            errors=errors,
+        ))
+
+    def export_stream_view(self, request, format):
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+        if format not in exports.FORMATS:
+            raise Http404(format)
+        iter_format, content_type = exports.FORMATS[format]
+        queryset = self.get_queryset(request)
+        status = request.GET.get('status')
+        if status:
+            queryset = queryset.filter(status=status)
+        fields = exports.get_film_fields(ratings=bool(request.GET.get('ratings')))
+        response = StreamingHttpResponse(iter_format(queryset, fields), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="filmy.{ format }"'
+        return response
+
+    def ranking_view(self, request):
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+        status = request.GET.get('status')
+        rows = [ranking.to_row(score) for score in ranking.get_ranking(status=status)]
+        if request.GET.get('format') == 'csv':
+            response = HttpResponse(content_type='text/csv; charset=utf-8')
+            response['Content-Disposition'] = 'attachment; filename="poradi-filmu.csv"'
+            writer = csv.writer(response)
+            writer.writerow(ranking.CSV_HEADER)
+            writer.writerows(rows)
+            return response
+        return TemplateResponse(request, 'admin/festival/film/ranking.html', dict(
+            self.admin_site.each_context(request),
+            opts=self.model._meta,
+            title='Pořadí filmů',
+            header=ranking.CSV_HEADER,
+            rows=rows,
+            status=status,
+            status_choices=models.Film.STATUS_CHOICES,
+        ))
 
     def send_unpaid_remainder(self, request, queryset):
-        for obj in queryset:
-            sent = obj.send_unpaid_remainder()
+        films = list(queryset)
+        results = mailer.send_unpaid_reminders(films)
+        for obj in films:
+            sent = results.get(obj.id, -1)
             if sent == 1:
                 messages.info(request, f'Připomenutí registrce filmu { obj.name } odesláno na adresu { obj.email }.')
             elif sent == 0:
                 messages.error(request, f'Připomenutí registrce filmu { obj.name } se nepodařilo odeslat na adresu { obj.email }.')
 
+    def mark_registered(self, request, queryset):
+        films = models.Film.update_status(queryset, models.Film.REGISTERED)
+        messages.info(request, f'Jako registrované označeno { len(films) } filmů.')
+
+    mark_registered.short_description = 'Označit jako registrované (zaplacené)'
+
 
 @admin.register(models.Evaluation)
-class EvaluationAdmin(admin.ModelAdmin):
+class EvaluationAdmin(ProjectedChangeListMixin, admin.ModelAdmin):
     model = models.Evaluation
+    list_select_related = ['user', 'film']
+    list_defer = [f'film__{ field }' for field in FILM_TEXT_FIELDS]
     readonly_fields = ['user']
     list_display = ['__str__', 'user', 'film', 'like', 'verbal', 'technical']
     list_filter = ['film', 'user', 'technical']
@@ -202,13 +333,16 @@ class SponsorAdmin(admin.ModelAdmin):
 @admin.register(models.PressRelease)
 class PressRelease(admin.ModelAdmin):
     models = models.PressRelease
+    list_select_related = ['year']
     list_display = ['__str__', 'date_release', 'year']
     list_filter = ['year']
 
 
 @admin.register(models.ThepayPayment)
-class ThepayPaymentAdmin(admin.ModelAdmin):
+class ThepayPaymentAdmin(ProjectedChangeListMixin, admin.ModelAdmin):
     model = models.ThepayPayment
+    list_select_related = ['film']
+    list_defer = [f'film__{ field }' for field in FILM_TEXT_FIELDS]
     list_display = ['__str__', 'datetime', 'type', 'film', 'value', 'status', 'status_ok', 'valid_signature']
     list_filter = ['type', 'status', 'datetime']
 
@@ -219,6 +353,12 @@ class ThepayPaymentAdmin(admin.ModelAdmin):
     status_ok.boolean = True
 
 
+@admin.register(models.ThepayReconciliation)
+class ThepayReconciliationAdmin(admin.ModelAdmin):
+    model = models.ThepayReconciliation
+    list_display = ['checkpoint', 'datetime', 'created', 'updated', 'registered']
+
+
 @admin.register(models.Texts)
 class TextsAdmin(admin.ModelAdmin):
     model = models.Texts
@@ -293,6 +433,26 @@ class TextsAdmin(admin.ModelAdmin):
     )
 
 @admin.register(models.Email)
-class EmailModelAdmin(admin.ModelAdmin):
+class EmailModelAdmin(ProjectedChangeListMixin, admin.ModelAdmin):
     models = models.Email
-    list_display = ['datetime', 'subject', 'message', 'recipient_list', ]
+    list_display = ['datetime', 'subject', 'get_message_preview', 'recipient_list', 'sent', 'attempts']
+    list_defer = ['message', 'message_html', 'error']
+    message_preview_length = 100
+
+    def get_changelist_queryset(self, queryset):
+        return super().get_changelist_queryset(queryset).annotate(
+            message_preview=Substr('message', 1, self.message_preview_length))
+
+    def get_message_preview(self, obj):
+        if len(obj.message_preview) < self.message_preview_length:
+            return obj.message_preview
+        return f'{ obj.message_preview }…'
+
+    get_message_preview.short_description = 'zpráva'
+    list_filter = ['sent']
+    actions = ['requeue']
+
+    def requeue(self, request, queryset):
+        queryset.filter(sent=False).update(attempts=0, next_attempt=None)
+
+    requeue.short_description = 'Znovu zařadit do fronty k odeslání'
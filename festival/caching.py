@@ -0,0 +1,102 @@
+import threading
+import time
+from datetime import date
+
+from django.conf import settings
+from django.core.cache import cache
+from django.template import Template
+
+
+SECTION_LIST = 'section_list'
+TEXTS = 'texts'
+CURRENT_YEAR = 'current_year'
+YEARS = 'years'
+
+MISSING = object()
+
+_templates = {}
+_templates_lock = threading.Lock()
+_year_registries = {}
+_year_registries_lock = threading.Lock()
+
+
+def get_version(name):
+    return cache.get_or_set(f'festival:{ name }:version', time.time(), None)
+
+
+def invalidate(name):
+    cache.set(f'festival:{ name }:version', time.time(), None)
+
+
+def get_section_list_key(role, language, is_staff, *flags):
+    flags = ''.join(str(int(bool(flag))) for flag in flags)
+    return f'festival:{ SECTION_LIST }:{ get_version(SECTION_LIST) }:{ date.today() }:{ role }:{ language }:{ int(is_staff) }:{ flags }'
+
+
+def get_section_list(key):
+    return cache.get(key)
+
+
+def set_section_list(key, content):
+    cache.set(key, content, settings.FESTIVAL_CACHE_TIMEOUT)
+
+
+def invalidate_section_list():
+    invalidate(SECTION_LIST)
+
+
+def get_texts(queryset, fields=()):
+    key = f'festival:{ TEXTS }:{ get_version(TEXTS) }:{ ",".join(sorted(fields)) }'
+    texts = cache.get(key)
+    if texts is None:
+        if fields:
+            queryset = queryset.only(*fields)
+        texts = queryset.first()
+        if texts is not None:
+            cache.set(key, texts, settings.FESTIVAL_CACHE_TIMEOUT)
+    return texts
+
+
+def invalidate_texts():
+    invalidate(TEXTS)
+
+
+def get_texts_template(texts, field):
+    source = getattr(texts, field)
+    template = _templates.get((field, source))
+    if template is None:
+        template = Template(source)
+        with _templates_lock:
+            for key in [key for key in _templates if key[0] == field]:
+                _templates.pop(key, None)
+            _templates[(field, source)] = template
+    return template
+
+
+def get_current_year(queryset):
+    key = f'festival:{ CURRENT_YEAR }:{ get_version(CURRENT_YEAR) }'
+    year = cache.get(key, MISSING)
+    if year is MISSING:
+        year = queryset.filter(current=True).first()
+        cache.set(key, year, settings.FESTIVAL_CACHE_TIMEOUT)
+    return year
+
+
+def invalidate_current_year():
+    invalidate(CURRENT_YEAR)
+
+
+def get_year_registry(name, build):
+    version = get_version(YEARS)
+    registry, built = _year_registries.get((name, version), (None, 0))
+    if registry is None or time.time() - built > settings.FESTIVAL_CACHE_TIMEOUT:
+        registry = build()
+        with _year_registries_lock:
+            for key in [key for key in _year_registries if key[0] == name]:
+                _year_registries.pop(key, None)
+            _year_registries[(name, version)] = (registry, time.time())
+    return registry
+
+
+def invalidate_years():
+    invalidate(YEARS)
@@ -0,0 +1,45 @@
+import csv
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from . import models
+
+
+CHUNK_SIZE = 500
+RATING_FIELDS = ['rating', 'evaluation_count', 'technical_yes', 'technical_no']
+
+
+class Echo:
+    def write(self, value):
+        return value
+
+
+def get_film_fields(ratings=False):
+    fields = [field.attname for field in models.Film._meta.concrete_fields
+              if field.name not in RATING_FIELDS and field.name != 'like_sum']
+    if ratings:
+        fields += RATING_FIELDS
+    return fields
+
+
+def iter_rows(queryset, fields):
+    return queryset.order_by('id').values_list(*fields).iterator(chunk_size=CHUNK_SIZE)
+
+
+def iter_csv(queryset, fields):
+    writer = csv.writer(Echo())
+    yield writer.writerow(fields)
+    for row in iter_rows(queryset, fields):
+        yield writer.writerow(row)
+
+
+def iter_jsonl(queryset, fields):
+    for row in iter_rows(queryset, fields):
+        yield json.dumps(dict(zip(fields, row)), cls=DjangoJSONEncoder, ensure_ascii=False) + '\n'
+
+
+FORMATS = {
+    'csv': (iter_csv, 'text/csv; charset=utf-8'),
+    'jsonl': (iter_jsonl, 'application/x-ndjson; charset=utf-8'),
+}
@@ -1,9 +1,29 @@
+import csv
+import io
+import json
+
 from django import forms
 from . import models
 
 
+class CropBoxField(forms.CharField):
+    widget = forms.HiddenInput
+
+    def to_python(self, value):
+        value = super().to_python(value)
+        if not value:
+            return None
+        try:
+            box = tuple(round(float(coordinate)) for coordinate in value.split(','))
+        except (ValueError, OverflowError):
+            raise forms.ValidationError('Neplatné souřadnice ořezu.')
+        if len(box) != 4 or box[0] >= box[2] or box[1] >= box[3]:
+            raise forms.ValidationError('Neplatné souřadnice ořezu.')
+        return box
+
+
 class PhotoAdminForm(forms.ModelForm):
-    cropped = forms.CharField(widget=forms.HiddenInput, required=False)
+    cropped = CropBoxField(required=False)
 
     class Meta:
         fields = ['original', 'description', 'description_en', 'year', 'order']
@@ -16,3 +36,50 @@ class GalleryAdminForm(forms.ModelForm):
     class Meta:
         fields = ['photo_list']
         model = models.Year
+
+
+class FilmImportForm(forms.ModelForm):
+    class Meta:
+        fields = '__all__'
+        model = models.Film
+
+
+class FilmBulkImportForm(forms.Form):
+    file = forms.FileField(label='soubor (CSV nebo JSON Lines)')
+    notify = forms.BooleanField(label='zařadit notifikace tvůrcům do fronty', required=False)
+    max_errors = 50
+
+    def parse_line(self, line):
+        try:
+            row = json.loads(line)
+        except ValueError as error:
+            return None, {'json': [f'neplatný řádek ({ error })']}
+        if not isinstance(row, dict):
+            return None, {'json': ['řádek musí být JSON objekt']}
+        return row, None
+
+    def get_rows(self):
+        file = io.TextIOWrapper(self.cleaned_data['file'], encoding='utf-8-sig')
+        if self.cleaned_data['file'].name.endswith(('.jsonl', '.json')):
+            return (self.parse_line(line) for line in file if line.strip())
+        return ((row, None) for row in csv.DictReader(file))
+
+    def get_films(self):
+        films = []
+        errors = []
+        try:
+            for number, (row, row_errors) in enumerate(self.get_rows(), 1):
+                if row is not None:
+                    form = FilmImportForm(data=row)
+                    if form.is_valid():
+                        films.append(form.save(commit=False))
+                        continue
+                    row_errors = form.errors
+                errors.append((number, row_errors))
+                if len(errors) >= self.max_errors:
+                    break
+        except UnicodeDecodeError:
+            self.add_error('file', 'Soubor není v kódování UTF-8.')
+        except csv.Error as error:
+            self.add_error('file', f'Soubor není platné CSV ({ error }).')
+        return films, errors
@@ -0,0 +1,163 @@
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import get_connection
+from django.db.models import Q
+from django.utils import timezone
+
+from . import models
+
+
+LEASE = timedelta(minutes=10)
+
+
+def get_backoff(attempts):
+    return timedelta(seconds=min(60 * 2 ** (attempts - 1), 60 * 60))
+
+
+class ConnectionPool:
+    def __init__(self, size=None, max_idle=None, max_messages=None):
+        self.size = settings.FESTIVAL_EMAIL_POOL_SIZE if size is None else size
+        self.max_idle = settings.FESTIVAL_EMAIL_POOL_MAX_IDLE if max_idle is None else max_idle
+        self.max_messages = settings.FESTIVAL_EMAIL_POOL_MAX_MESSAGES if max_messages is None else max_messages
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def is_usable(self, connection):
+        return (time.monotonic() - connection.pool_released < self.max_idle
+                and connection.pool_messages < self.max_messages)
+
+    def acquire(self):
+        stale = []
+        connection = None
+        with self._lock:
+            while self._idle and connection is None:
+                candidate = self._idle.pop()
+                if self.is_usable(candidate):
+                    connection = candidate
+                else:
+                    stale.append(candidate)
+        for candidate in stale:
+            self.close(candidate)
+        if connection is None:
+            connection = get_connection()
+            connection.pool_messages = 0
+            connection.open()
+        return connection
+
+    def release(self, connection, messages=0):
+        connection.pool_messages += messages
+        connection.pool_released = time.monotonic()
+        if connection.pool_messages < self.max_messages:
+            with self._lock:
+                if len(self._idle) < self.size:
+                    self._idle.append(connection)
+                    return
+        self.close(connection)
+
+    def close(self, connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def clear(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection in idle:
+            self.close(connection)
+
+    def send_messages(self, messages):
+        sent = 0
+        for start in range(0, len(messages), self.max_messages):
+            sent += self._send_messages(messages[start:start + self.max_messages]) or 0
+        return sent
+
+    def _send_messages(self, messages):
+        connection = self.acquire()
+        try:
+            sent = connection.send_messages(messages)
+        except Exception:
+            self.close(connection)
+            if not connection.pool_messages:
+                raise
+            connection = self.acquire()
+            try:
+                sent = connection.send_messages(messages)
+            except Exception:
+                self.close(connection)
+                raise
+        self.release(connection, len(messages))
+        return sent
+
+
+pool = ConnectionPool()
+
+
+def deliver(email, sender):
+    try:
+        email.sent = email.send(sender=sender)
+        email.error = None
+    except Exception as e:
+        email.sent = False
+        email.error = repr(e)
+    email.attempts += 1
+    return email.sent
+
+
+def claim_queued(batch_size, queryset=None):
+    now = timezone.now()
+    queryset = models.Email.objects.all() if queryset is None else queryset
+    due = queryset.filter(sent=False, attempts__lt=settings.FESTIVAL_EMAIL_MAX_ATTEMPTS).filter(
+        Q(next_attempt=None) | Q(next_attempt__lte=now))
+    ids = list(due.order_by('id').values_list('id', flat=True)[:batch_size])
+    lease = now + LEASE
+    due.filter(id__in=ids).update(next_attempt=lease)
+    return list(models.Email.objects.filter(id__in=ids, next_attempt=lease).order_by('id'))
+
+
+def send_queued(batch_size=None, queryset=None):
+    emails = claim_queued(batch_size or settings.FESTIVAL_EMAIL_BATCH_SIZE, queryset)
+    if not emails:
+        return 0, 0
+    sender = models.Texts.get_cached('default_from_email').default_from_email
+    sent = 0
+    for email in emails:
+        deliver(email, sender)
+        email.next_attempt = None if email.sent else timezone.now() + get_backoff(email.attempts)
+        email.save(update_fields=['sent', 'attempts', 'next_attempt', 'error'])
+        sent += email.sent
+    return sent, len(emails) - sent
+
+
+def send_bulk(emails, sender, rate=None, batch_size=None, progress=None):
+    rate = settings.FESTIVAL_EMAIL_RATE if rate is None else rate
+    batch_size = batch_size or settings.FESTIVAL_EMAIL_BATCH_SIZE
+    for start in range(0, len(emails), batch_size):
+        batch = emails[start:start + batch_size]
+        if not settings.FESTIVAL_EMAIL_OUTBOX:
+            for email in batch:
+                deliver(email, sender)
+                if rate:
+                    time.sleep(1 / rate)
+        models.Email.objects.bulk_create(batch)
+        if progress:
+            progress(start + len(batch), len(emails))
+    return emails
+
+
+def send_unpaid_reminders(films, rate=None, batch_size=None, progress=None):
+    texts = models.Texts.get_cached()
+    films = [film for film in films if film.status == models.Film.UNPAID]
+    reminders = send_bulk([film.get_unpaid_email(texts, models.Film.UNPAID_REMINDER) for film in films], texts.default_from_email,
+                          rate, batch_size, progress)
+    return {film.id: int(email.sent or email.is_queued()) for film, email in zip(films, reminders)}
+
+
+def send_paid_confirmations(films, rate=None, batch_size=None, progress=None):
+    texts = models.Texts.get_cached()
+    confirmations = send_bulk([film.get_paid_confirmation(texts) for film in films], texts.default_from_email,
+                              rate, batch_size, progress)
+    return {film.id: int(email.sent or email.is_queued()) for film, email in zip(films, confirmations)}
@@ -0,0 +1,146 @@
+import socketserver
+import threading
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from festival import caching, mailer, models
+
+
+class SMTPSinkHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(f'{ line }\r\n'.encode())
+
+    def handle(self):
+        self.reply('220 festival smtp sink')
+        in_data = False
+        for line in self.rfile:
+            if in_data:
+                if line.rstrip(b'\r\n') == b'.':
+                    in_data = False
+                    if self.server.delay:
+                        time.sleep(self.server.delay)
+                    self.server.count()
+                    self.reply('250 OK')
+                continue
+            command = line[:4].upper()
+            if command == b'DATA':
+                in_data = True
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+            elif command == b'QUIT':
+                self.reply('221 Bye')
+                break
+            else:
+                self.reply('250 OK')
+
+
+class SMTPSink(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, delay=0):
+        super().__init__(('127.0.0.1', 0), SMTPSinkHandler)
+        self.delay = delay
+        self.received = 0
+        self._lock = threading.Lock()
+
+    def count(self):
+        with self._lock:
+            self.received += 1
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self.server_address[1]
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class Command(BaseCommand):
+    help = 'Změří propustnost automatických emailů proti lokálnímu SMTP serveru. Běží nad dočasnou testovací databází.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--films', type=int, default=100, help='počet registrovaných filmů')
+        parser.add_argument('--delay', type=float, default=0, help='umělé zpoždění SMTP serveru na zprávu v milisekundách')
+        parser.add_argument('--outbox', action='store_true', help='emaily řadit do fronty a odeslat je až příkazem send_emails')
+
+    def handle(self, *args, **options):
+        database = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        sink = SMTPSink(options['delay'] / 1000)
+        port = sink.start()
+        mailer.pool.clear()
+        try:
+            with override_settings(
+                EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+                EMAIL_HOST='127.0.0.1', EMAIL_PORT=port, EMAIL_USE_TLS=False, EMAIL_USE_SSL=False,
+                EMAIL_HOST_USER='', EMAIL_HOST_PASSWORD='', FESTIVAL_EMAIL_OUTBOX=options['outbox'],
+            ):
+                self.run(sink, options)
+        finally:
+            mailer.pool.clear()
+            sink.stop()
+            connection.creation.destroy_test_db(database, verbosity=0)
+            connection.close()
+            caching.invalidate_texts()
+
+    def run(self, sink, options):
+        models.Texts.objects.create()
+        caching.invalidate_texts()
+        self.latencies = []
+        films = []
+        mailer.pool.send_messages = self.timed(mailer.ConnectionPool.send_messages.__get__(mailer.pool))
+        try:
+            self.measure(sink, 'registrace', lambda: films.extend(
+                models.Film.objects.create(
+                    first_name='Benchmark', last_name=str(i), email=f'benchmark{ i }@example.com',
+                    production='benchmark', country='CZ' if i % 2 else 'DE', name=f'benchmark { i }',
+                    time=timedelta(minutes=5), description='benchmark', year=2020, category=models.Film.FILM,
+                    genre=models.Film.DRAMA, film_url='https://example.com/film', subtitles_url='https://example.com/titulky',
+                ) for i in range(options['films'])
+            ))
+            self.measure(sink, 'platby', lambda: [
+                models.ThepayPayment.objects.create(
+                    value=100, currency='CZK', methodId=21, merchantData='benchmark', paymentId=900000000 + film.id,
+                    status=models.ThepayPayment.OK if i % 2 else models.ThepayPayment.CANCELED,
+                    type=models.ThepayPayment.FILM, valid_signature=True, film=film,
+                ) for i, film in enumerate(films)
+            ])
+            self.measure(sink, 'připomenutí', lambda: mailer.send_unpaid_reminders(
+                models.Film.objects.filter(status=models.Film.UNPAID)))
+            if options['outbox']:
+                self.measure(sink, 'fronta', lambda: mailer.send_queued(len(films) * 3))
+        finally:
+            del mailer.pool.send_messages
+
+    def timed(self, send_messages):
+        def wrapper(messages):
+            start = time.perf_counter()
+            try:
+                return send_messages(messages)
+            finally:
+                self.latencies.append((time.perf_counter() - start) / max(len(messages), 1))
+        return wrapper
+
+    def measure(self, sink, name, flow):
+        received = sink.received
+        self.latencies = []
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            result = flow()
+            elapsed = time.perf_counter() - start
+        messages = sink.received - received
+        latencies = sorted(self.latencies)
+        if not messages:
+            self.stdout.write(f'{ name }: žádné odeslané zprávy za { elapsed:.2f} s, { len(queries) } dotazů')
+            return result
+        p95 = latencies[int(0.95 * (len(latencies) - 1))] * 1000 if latencies else 0
+        self.stdout.write(
+            f'{ name }: { messages } zpráv za { elapsed:.2f} s, { messages / elapsed:.1f} zpráv/s, '
+            f'p95 odeslání { p95:.1f} ms, { len(queries) / messages:.1f} dotazů/zprávu'
+        )
+        return result
@@ -0,0 +1,23 @@
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from festival import models, thumbnails
+
+
+class Command(BaseCommand):
+    help = 'Vygeneruje náhledy všech fotek, které ještě nejsou vygenerované.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=settings.FESTIVAL_THUMBNAIL_WORKERS or 1)
+        parser.add_argument('--year', type=int, help='id ročníku, jehož fotky se mají zpracovat')
+
+    def handle(self, *args, **options):
+        photos = models.Photo.objects.exclude(original='').exclude(original=None)
+        if options['year']:
+            photos = photos.filter(year_id=options['year'])
+        jobs = [thumbnails.get_job(photo) for photo in photos.only('id', 'original', 'width', 'height').iterator()]
+        with ProcessPoolExecutor(max_workers=options['workers']) as executor:
+            for done, photo_id in enumerate(executor.map(thumbnails.generate, *zip(*jobs), chunksize=8), 1):
+                self.stdout.write(f'{ done }/{ len(jobs) } fotka { photo_id }')
@@ -0,0 +1,36 @@
+import os
+
+from django.core.files import File
+from django.core.management.base import BaseCommand, CommandError
+
+from festival import models
+
+
+class Command(BaseCommand):
+    help = 'Naimportuje fotky z adresáře do galerie zadaného ročníku.'
+    extensions = ['.jpg', '.jpeg', '.png', '.gif', '.webp']
+
+    def add_arguments(self, parser):
+        parser.add_argument('year', type=int, help='id ročníku')
+        parser.add_argument('directory')
+        parser.add_argument('--description', help='popisek fotek, výchozí je rok ročníku')
+        parser.add_argument('--batch-size', type=int, default=200)
+
+    def handle(self, *args, **options):
+        year = models.Year.objects.filter(id=options['year']).first()
+        if year is None:
+            raise CommandError(f'Ročník s id { options["year"] } neexistuje.')
+        directory = options['directory']
+        if not os.path.isdir(directory):
+            raise CommandError(f'Adresář { directory } neexistuje.')
+        paths = sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                       if os.path.splitext(name)[1].lower() in self.extensions)
+        batch_size = options['batch_size']
+        for start in range(0, len(paths), batch_size):
+            files = [File(open(path, 'rb'), name=os.path.basename(path)) for path in paths[start:start + batch_size]]
+            try:
+                photos = models.Photo.ingest(files, year, options['description'])
+            finally:
+                for file in files:
+                    file.close()
+            self.stdout.write(f'{ start + len(photos) }/{ len(paths) } fotek naimportováno do galerie { year }.')
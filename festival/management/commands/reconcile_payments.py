@@ -0,0 +1,46 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from festival import mailer, models, the_pay
+
+
+class Command(BaseCommand):
+    help = 'Dotáhne stavy plateb z datového API ThePay a zaregistruje zaplacené filmy.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', help='adresa datového API, výchozí je TP_DATA_API_URL')
+        parser.add_argument('--days', type=int, default=30, help='při prvním spuštění zpracovat platby za posledních N dní')
+        parser.add_argument('--overlap', type=int, default=60, help='překryv s minulou synchronizací v minutách')
+        parser.add_argument('--page-size', type=int, default=100)
+        parser.add_argument('--no-notify', action='store_true', help='neposílat potvrzení o zaplacení')
+
+    def handle(self, *args, **options):
+        api = the_pay.DataApi(url=options['url'])
+        checkpoint = models.ThepayReconciliation.get_checkpoint()
+        until = timezone.now()
+        if checkpoint is None:
+            since = until - timedelta(days=options['days'])
+        else:
+            since = checkpoint - timedelta(minutes=options['overlap'])
+        created = updated = skipped = 0
+        films = []
+        try:
+            for records in api.iter_payments(since, until, options['page_size']):
+                with transaction.atomic():
+                    page_created, page_updated, page_skipped, page_films = models.ThepayPayment.reconcile(
+                        records, notify=not options['no_notify'])
+                created += page_created
+                updated += page_updated
+                skipped += page_skipped
+                films += page_films
+        except the_pay.DataApiError as e:
+            raise CommandError(f'Datové API ThePay selhalo: { e }')
+        finally:
+            mailer.pool.clear()
+        models.ThepayReconciliation.objects.create(
+            checkpoint=until, created=created, updated=updated, registered=len(films))
+        self.stdout.write(f'nových plateb { created }, aktualizovaných { updated }, přeskočených s neznámým stavem { skipped }, '
+                          f'registrovaných filmů { len(films) }')
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from festival import models
+
+
+class Command(BaseCommand):
+    help = 'Přepočítá pořadí a sousedy fotek ve všech galeriích.'
+
+    def handle(self, *args, **options):
+        for year in models.Year.objects.all():
+            models.Photo.refresh_gallery(year.id)
+            self.stdout.write(f'Galerie { year } přepočítána.')
+        models.Photo.refresh_gallery(None)
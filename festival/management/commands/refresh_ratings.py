@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from festival import models
+
+
+class Command(BaseCommand):
+    help = 'Přepočítá průměrná hodnocení a počty hodnocení všech filmů.'
+
+    def handle(self, *args, **options):
+        models.Film.refresh_ratings()
+        self.stdout.write(f'Hodnocení { models.Film.objects.count() } filmů přepočítáno.')
@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from festival import mailer
+
+
+class Command(BaseCommand):
+    help = 'Odešle automatické emaily čekající ve frontě.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int)
+        parser.add_argument('--loop', action='store_true', help='běžet stále a frontu průběžně vyprazdňovat')
+        parser.add_argument('--interval', type=float, default=5, help='pauza mezi dávkami v sekundách')
+
+    def handle(self, *args, **options):
+        try:
+            while True:
+                sent, failed = mailer.send_queued(options['batch_size'])
+                if sent or failed:
+                    self.stdout.write(f'odesláno { sent }, neodesláno { failed }')
+                if not options['loop']:
+                    break
+                if not (sent or failed):
+                    time.sleep(options['interval'])
+        finally:
+            mailer.pool.clear()
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from festival import mailer, models
+
+
+class Command(BaseCommand):
+    help = 'Rozešle připomenutí všem filmům s neuhrazeným registračním poplatkem.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rate', type=float, help='maximální počet emailů za sekundu')
+        parser.add_argument('--batch-size', type=int)
+
+    def handle(self, *args, **options):
+        films = models.Film.objects.filter(status=models.Film.UNPAID).order_by('id')
+        try:
+            results = mailer.send_unpaid_reminders(
+                films, rate=options['rate'], batch_size=options['batch_size'],
+                progress=lambda done, total: self.stdout.write(f'{ done }/{ total } připomenutí zpracováno'),
+            )
+        finally:
+            mailer.pool.clear()
+        failed = [film_id for film_id, sent in results.items() if not sent]
+        self.stdout.write(f'odesláno { len(results) - len(failed) }, neodesláno { len(failed) }')
+        if failed:
+            self.stdout.write(f'neodeslaná připomenutí filmů: { ", ".join(str(film_id) for film_id in failed) }')
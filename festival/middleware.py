@@ -1,58 +1,58 @@
 import re
+from django.urls import get_resolver
 from django.utils import translation
+from django.utils.functional import Promise
 
 
 class FestivalLocaleMiddleware:
     def __init__(self, get_response):
         self.get_response = get_response
 
-    en_urls = [re.compile(p) for p in [
-        '^/author/', '^/author',
-        '^/visitor/', '^/visitor',
-        '^/journalist/', '^/journalist',
-        '^/gallery/', '^/gallery',
-        '^/articles/', '^/articles',
-        '^/thanks-for-film-registration/', '^/thanks-for-film-registration',
-        '^/thanks-for-tickets-purchase/', '^/thanks-for-tickets-purchase',
-        '^/repeat-payment/', '^/repeat-payment',
-        '^/pay-registration-fee/', '^/pay-registration-fee',
-        '^/pay-registration/', '^/pay-registration',
-        '^/terms-of-registration/', '^/terms-of-registration',
-        '^/privacy-policy/', '^/privacy-policy',
-    ]]
-    cs_urls = [re.compile(p) for p in [
-        '^/tvurce/', '^/tvurce',
-        '^/navstevnik/', '^/navstevnik',
-        '^/novinar/', '^/novinar',
-        '^/galerie/', '^/galerie',
-        '^/clanky/', '^/clanky',
-        '^/dekujeme-za-registraci-filmu/', '^/dekujeme-za-registraci-filmu',
-        '^/dekujeme-za-zakoupeni-vstupenek/', '^/dekujeme-za-zakoupeni-vstupenek',
-        '^/opakovat-platbu/', '^/opakovat-platbu',
-        '^/zaplatit-registraci/', '^/zaplatit-registraci',
-        '^/podminky-prihlaseni/', '^/podminky-prihlaseni',
-        '^/zasady-zpracovani-osobnich-udaju/', '^/zasady-zpracovani-osobnich-udaju',
-    ]]
+    languages = ['en', 'cs']
+    untranslated_prefixes = {
+        'en': ['pay-registration'],
+    }
+    session_key = 'LANGUAGE_SESSION_KEY'
+    cookie_name = 'django_language'
+    _lang_url = None
+
+    def get_prefixes(self):
+        prefixes = {lang: set(self.untranslated_prefixes.get(lang, [])) for lang in self.languages}
+        for pattern in get_resolver().url_patterns:
+            route = getattr(pattern.pattern, '_route', None)
+            if isinstance(route, Promise):
+                for lang in self.languages:
+                    with translation.override(lang):
+                        prefixes[lang].add(str(route).split('/')[0])
+        return prefixes
+
+    def get_lang_url(self):
+        if self._lang_url is None:
+            prefixes = self.get_prefixes()
+            groups = '|'.join(
+                f"(?P<{ lang }>{ '|'.join(re.escape(p) for p in sorted(prefixes[lang], key=len, reverse=True)) })"
+                for lang in self.languages if prefixes[lang]
+            )
+            FestivalLocaleMiddleware._lang_url = re.compile(f'^/(?:{ groups })(?:/|$)')
+        return self._lang_url
 
     def get_lang_from_url(self, request):
-        for url in self.en_urls:
-            if url.search(request.path_info):
-                return 'en'
-        for url in self.cs_urls:
-            if url.search(request.path_info):
-                return 'cs'
+        match = self.get_lang_url().match(request.path_info)
+        if match:
+            return match.lastgroup
         return None
 
     def __call__(self, request):
         language_from_url = self.get_lang_from_url(request)
         if language_from_url:
-            request.session['LANGUAGE_SESSION_KEY'] = language_from_url
+            if request.session.get(self.session_key) != language_from_url:
+                request.session[self.session_key] = language_from_url
             translation.activate(language_from_url)
         else:
             language_from_request = translation.get_language_from_request(request, check_path=False)
             translation.activate(language_from_request)
         request.LANGUAGE_CODE = translation.get_language()
         response = self.get_response(request)
-        if language_from_url:
-            response.set_cookie('django_language', language_from_url)
-        return response
\ No newline at end of file
+        if language_from_url and request.COOKIES.get(self.cookie_name) != language_from_url:
+            response.set_cookie(self.cookie_name, language_from_url)
+        return response
@@ -1,24 +1,31 @@
+import json
 import os
+from collections import defaultdict
 from datetime import date
+from io import BytesIO
 
 from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
 from django.core.files.storage import FileSystemStorage
 from django.core.mail import get_connection, EmailMultiAlternatives
 from django.core.validators import MaxValueValidator, MinValueValidator, FileExtensionValidator, RegexValidator
-from django.db import models, transaction
+from django.db import connection, models, transaction
+from django.db.models import Case, Value, When
+from django.db.models.functions import Coalesce
 from django.dispatch import receiver
 from django.forms import ModelForm
 from django.utils.text import slugify
 from django.utils.translation import gettext_lazy as _
-from django.template import Context, Template
+from django.template import Context
 
 from ckeditor.fields import RichTextField
 from imagekit import ImageSpec, register
 from imagekit.models import ImageSpecField
 from imagekit.processors import ResizeToFit, ResizeToFill
+from PIL import Image
 
-from . import widgets, iso3166
+from . import caching, mailer, thumbnails, widgets, iso3166
 
 
 class OverwriteStorage(FileSystemStorage):
@@ -28,6 +35,24 @@ class OverwriteStorage(FileSystemStorage):
         return name
 
 
+def allocate_ids(model, count):
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT nextval(pg_get_serial_sequence(%s, %s)) FROM generate_series(1, %s)',
+                           [table, model._meta.pk.column, count])
+            return [row[0] for row in cursor.fetchall()]
+        cursor.execute(f'UPDATE { connection.ops.quote_name(table) } SET id = id WHERE 0 = 1')
+        last_id = None
+        if connection.vendor == 'sqlite':
+            cursor.execute('SELECT seq FROM sqlite_sequence WHERE name = %s', [table])
+            row = cursor.fetchone()
+            last_id = row and row[0]
+        if last_id is None:
+            last_id = model.objects.aggregate(models.Max('id'))['id__max'] or 0
+    return list(range(last_id + 1, last_id + count + 1))
+
+
 def path_photo(instance, filename):
     if instance.year:
         return f"gallery/{ instance.year.get_year() }/{ instance.id }-{ slugify(instance.description) }.{ filename.split('.')[-1] }"
@@ -38,27 +63,43 @@ def path_photo_cropped(instance, filename):
     return f"{ ''.join(instance.original.url.replace('/media/', '').split('.')[0:-1]) }_cropped.png"
 
 
+Image.init()
+WEBP_SUPPORTED = 'WEBP' in Image.SAVE
+AVIF_SUPPORTED = 'AVIF' in Image.SAVE
+
+
 class AutoCrop(ImageSpec):
     processors = [ResizeToFill(250, 250)]
     format = 'JPEG'
     options = {'quality': 100}
 
 
+class AutoCropWebP(AutoCrop):
+    format = 'WEBP'
+    options = {'quality': 85}
+
+
 register.generator('festival:auto_crop', AutoCrop)
+if WEBP_SUPPORTED:
+    register.generator('festival:auto_crop_webp', AutoCropWebP)
 
 
 def send_mass_html_mail(datatuple, fail_silently=False, auth_user=None, auth_password=None, connection=None):
-    connection = connection or get_connection(
-        username=auth_user,
-        password=auth_password,
-        fail_silently=fail_silently,
-    )
+    pooled = connection is None and auth_user is None and auth_password is None and not fail_silently
+    if not pooled:
+        connection = connection or get_connection(
+            username=auth_user,
+            password=auth_password,
+            fail_silently=fail_silently,
+        )
     messages = []
     for subject, message, message_html, sender, recipient in datatuple:
         msg = EmailMultiAlternatives(subject, message, sender, recipient, connection=connection)
         if message_html:
             msg.attach_alternative(message_html, 'text/html')
         messages.append(msg)
+    if pooled:
+        return mailer.pool.send_messages(messages)
     return connection.send_messages(messages)
 
 
@@ -90,6 +131,7 @@ class Year(models.Model):
         if self.current:
             Year.objects.filter(current=True).update(current=False)
         super().save(*args, **kwargs)
+        caching.invalidate_current_year()
 
     def get_year(self):
         return self.date_start.year
@@ -107,7 +149,7 @@ class Year(models.Model):
 
     @classmethod
     def get_current(cls):
-        return cls.objects.filter(current=True).first()
+        return caching.get_current_year(Year.objects.all())
 
 
 class Gallery(Year):
@@ -211,23 +253,45 @@ class Photo(models.Model):
     small = ImageSpecField(source='original', processors=[ResizeToFit(300, 300)], format='JPEG', options={'quality': 85})
     middle = ImageSpecField(source='original', processors=[ResizeToFit(600, 600)], format='JPEG', options={'quality': 90})
     large = ImageSpecField(source='original', processors=[ResizeToFit(1200, 1200)], format='JPEG', options={'quality': 95})
+    if WEBP_SUPPORTED:
+        small_webp = ImageSpecField(source='original', processors=[ResizeToFit(300, 300)], format='WEBP', options={'quality': 80})
+        middle_webp = ImageSpecField(source='original', processors=[ResizeToFit(600, 600)], format='WEBP', options={'quality': 80})
+        large_webp = ImageSpecField(source='original', processors=[ResizeToFit(1200, 1200)], format='WEBP', options={'quality': 85})
+    if AVIF_SUPPORTED:
+        small_avif = ImageSpecField(source='original', processors=[ResizeToFit(300, 300)], format='AVIF', options={'quality': 60})
+        middle_avif = ImageSpecField(source='original', processors=[ResizeToFit(600, 600)], format='AVIF', options={'quality': 60})
+        large_avif = ImageSpecField(source='original', processors=[ResizeToFit(1200, 1200)], format='AVIF', options={'quality': 65})
     description = models.CharField('popisek', max_length=200)
     description_en = models.CharField('popisek anglicky', max_length=200, null=True, blank=True)
     year = models.ForeignKey(Year, verbose_name='galerie', on_delete=models.SET_NULL, null=True, blank=True)
     order = models.PositiveSmallIntegerField('pořadí', default=1)
     slug = models.SlugField(editable=False, null=True)
+    gallery_position = models.PositiveIntegerField('pozice v galerii', null=True, editable=False)
+    gallery_length = models.PositiveIntegerField('počet fotek v galerii', null=True, editable=False)
+    previous_slug = models.SlugField(editable=False, null=True)
+    next_slug = models.SlugField(editable=False, null=True)
 
     class Meta:
         verbose_name = 'fotka'
         verbose_name_plural = 'fotky'
-        ordering = ['year', 'order']
+        ordering = ['year', 'order', 'id']
+        indexes = [
+            models.Index(fields=['year', 'gallery_position']),
+        ]
 
     def __str__(self):
         return self.description
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_year_id = dict(zip(field_names, values)).get('year_id')
+        return instance
+
     def save(self, *args, **kwargs):
         hidden_original = self.original
         hidden_cropped = self.cropped
+        uploaded = bool(hidden_original) and not hidden_original._committed
         self.original = None
         self.cropped = None
         super().save(*args, **kwargs)
@@ -235,27 +299,144 @@ class Photo(models.Model):
         self.cropped = hidden_cropped
         self.slug = f'{ self.id }-{ slugify(self.description) }'
         super().save(update_fields=['original', 'cropped', 'slug'])
+        if uploaded:
+            transaction.on_commit(lambda: thumbnails.generate_async([self]))
+        loaded_year_id = getattr(self, '_loaded_year_id', None)
+        if loaded_year_id != self.year_id:
+            Photo.refresh_gallery(loaded_year_id)
+        Photo.refresh_gallery(self.year_id)
+        self._loaded_year_id = self.year_id
+
+    RENDITIONS = (('small', 300), ('middle', 600), ('large', 1200))
+    CROP_SIZE = 250
+    GALLERY_INDEX_FIELDS = ['gallery_position', 'gallery_length', 'previous_slug', 'next_slug']
+    GALLERY_BATCH_SIZE = 100
 
     def get_ratio(self):
         return round(100*self.height/self.width) if (self.height and self.width) else 0
 
-    def assign_to(self, year):
-        self.year=year
-        self.save(update_fields=['year'])
+    def get_rendition_width(self, size):
+        if not (self.width and self.height):
+            return size
+        return round(self.width * min(size / self.width, size / self.height))
+
+    def get_srcset(self, suffix=''):
+        return ', '.join(f'{ getattr(self, name + suffix).url } { self.get_rendition_width(size) }w'
+                         for name, size in self.RENDITIONS)
+
+    def get_sources(self):
+        sources = []
+        if AVIF_SUPPORTED:
+            sources.append(('image/avif', self.get_srcset('_avif')))
+        if WEBP_SUPPORTED:
+            sources.append(('image/webp', self.get_srcset('_webp')))
+        return sources
+
+    def crop(self, box):
+        committed = self.original._committed
+        self.original.open('rb')
+        try:
+            with Image.open(self.original) as image:
+                width, height = image.size
+                left, upper = max(box[0], 0), max(box[1], 0)
+                right, lower = min(box[2], width), min(box[3], height)
+                if right <= left or lower <= upper:
+                    return False
+                scale = max(right - left, lower - upper) / self.CROP_SIZE
+                size = (max(round((right - left) / scale), 1), max(round((lower - upper) / scale), 1))
+                if scale > 1:
+                    image.draft('RGB', (round(width / scale), round(height / scale)))
+                factor = image.size[0] / width
+                image = image.crop(tuple(round(value * factor) for value in (left, upper, right, lower)))
+                if image.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+                    image = image.convert('RGB')
+                content = BytesIO()
+                image.resize(size, Image.LANCZOS).save(content, 'PNG')
+        finally:
+            if committed:
+                self.original.close()
+            else:
+                self.original.seek(0)
+        self.cropped = ContentFile(content.getvalue(), name=f'{ self.id }_cropped.png')
+        return True
 
     def get_gallery_info(self):
-        photos = list(Photo.objects.filter(year=self.year).values_list('slug', flat=True))
-        index = photos.index(self.slug)
-        length=len(photos)
         gallery_info = {
-            'index': index + 1,
-            'length': length,
-            'previous': photos[(index+1)%length],
-            'next': photos[(index+1)%length],
+            'index': self.gallery_position,
+            'length': self.gallery_length,
+            'previous': self.previous_slug,
+            'next': self.next_slug,
             'year': self.year.get_year()
         }
         return gallery_info
 
+    @classmethod
+    def ingest(cls, files, year, description=None):
+        description = str(description or year.get_year())
+        photos = []
+        try:
+            with transaction.atomic():
+                files = list(files)
+                for photo_id, file in zip(allocate_ids(cls, len(files)), files):
+                    photos.append(cls(id=photo_id, original=file, description=description, year=year,
+                                      slug=f'{ photo_id }-{ slugify(description) }'))
+                cls.objects.bulk_create(photos)
+                cls.refresh_gallery(year.id)
+        except Exception:
+            for photo in photos:
+                if photo.original and photo.original._committed:
+                    photo.original.storage.delete(photo.original.name)
+            raise
+        caching.invalidate_section_list()
+        transaction.on_commit(lambda: thumbnails.generate_async(photos))
+        return photos
+
+    @classmethod
+    def get_gallery_index(cls, photos):
+        length = len(photos)
+        return {photo_id: [index + 1, length, photos[index - 1][1], photos[(index + 1) % length][1]]
+                for index, (photo_id, slug) in enumerate(photos)}
+
+    @classmethod
+    def assign(cls, photos, year):
+        year_id = getattr(year, 'id', None)
+        photos = photos.exclude(year_id=year_id)
+        with transaction.atomic():
+            year_ids = set(photos.order_by().values_list('year_id', flat=True).distinct())
+            count = photos.update(year_id=year_id)
+            for changed_year_id in year_ids | {year_id}:
+                cls.refresh_gallery(changed_year_id)
+        if count:
+            caching.invalidate_section_list()
+        return count
+
+    @classmethod
+    def renumber(cls, year_ids):
+        count = cls.objects.filter(year_id__in=year_ids).exclude(order=models.F('gallery_position')).update(
+            order=models.F('gallery_position'))
+        if count:
+            caching.invalidate_section_list()
+        return count
+
+    @classmethod
+    def refresh_gallery(cls, year_id):
+        photos = cls.objects.filter(year_id=year_id)
+        if year_id is None:
+            photos.exclude(gallery_position=None).update(**dict.fromkeys(cls.GALLERY_INDEX_FIELDS))
+            return
+        indexed = list(photos.order_by('order', 'id').values_list('id', 'slug', *cls.GALLERY_INDEX_FIELDS))
+        gallery_index = cls.get_gallery_index([(photo_id, slug) for photo_id, slug, *current in indexed])
+        changed = [(photo_id, gallery_index[photo_id]) for photo_id, slug, *current in indexed
+                   if gallery_index[photo_id] != current]
+        with transaction.atomic():
+            photos.exclude(gallery_length=len(indexed)).update(gallery_length=len(indexed))
+            for start in range(0, len(changed), cls.GALLERY_BATCH_SIZE):
+                batch = changed[start:start + cls.GALLERY_BATCH_SIZE]
+                cls.objects.filter(id__in=[photo_id for photo_id, index in batch]).update(**{
+                    field: Case(*[When(id=photo_id, then=Value(index[position])) for photo_id, index in batch])
+                    for position, field in enumerate(cls.GALLERY_INDEX_FIELDS) if field != 'gallery_length'
+                })
+
 
 class Contact(models.Model):
     name = models.CharField('jméno', max_length=50)
@@ -368,45 +549,148 @@ class Film(models.Model):
     attendance = models.BooleanField('zájem o osobní účast na festivalu', default=False)
     status = models.CharField('status', max_length=1, choices=STATUS_CHOICES, default='u')
     technical_check = models.BooleanField('technicky ok', null=True, blank=True, default=None)
+    rating = models.FloatField('průměrné hodnocení', null=True, blank=True, editable=False)
+    evaluation_count = models.PositiveIntegerField('počet hodnocení', default=0, editable=False)
+    like_sum = models.PositiveIntegerField('součet hodnocení', default=0, editable=False)
+    technical_yes = models.PositiveIntegerField('technicky ok', default=0, editable=False)
+    technical_no = models.PositiveIntegerField('technicky špatně', default=0, editable=False)
 
     class Meta:
         verbose_name = 'film'
         verbose_name_plural = 'filmy'
+        indexes = [
+            models.Index(fields=['rating']),
+        ]
 
     def __str__(self):
         return self.name
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if 'status' in field_names:
+            instance._loaded_status = values[field_names.index('status')]
+        return instance
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and not args and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            deferred = self.get_deferred_fields()
+            kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields if not field.primary_key and
+                                       field.name not in self.RATING_FIELDS and field.attname not in deferred]
+        super().save(*args, **kwargs)
+        self._loaded_status = self.status
+
+    def get_loaded_status(self):
+        if not hasattr(self, '_loaded_status'):
+            self._loaded_status = None if self.id is None else Film.objects.filter(id=self.id).values_list(
+                'status', flat=True).first()
+        return self._loaded_status
+
+    def status_changed(self):
+        return self.get_loaded_status() not in [None, self.status]
+
+    @classmethod
+    def update_status(cls, films, status, notify=True):
+        films = list(films.exclude(status=status))
+        cls.objects.filter(id__in=[film.id for film in films]).update(status=status)
+        for film in films:
+            film.status = film._loaded_status = status
+        if notify and films and status == cls.REGISTERED:
+            transaction.on_commit(lambda: mailer.send_paid_confirmations(films))
+        return films
+
+    RATING_FIELDS = ['rating', 'evaluation_count', 'like_sum', 'technical_yes', 'technical_no']
+
     def get_rating(self):
-        rating = Evaluation.objects.filter(film=self).aggregate(models.Avg('like'))
-        return rating['like__avg']
+        return self.rating
 
     get_rating.short_description = 'průměrné hodnocení'
+    get_rating.admin_order_field = 'rating'
 
-    def send_unpaid_remainder(self):
-        if self.status == self.UNPAID:
-            texts = Texts.objects.first()
-            if self.country in ['CZ', 'SK']:
-                link_url=f'https://festivalkratasy.cz/zaplatit-registraci/{ self.id }/{ slugify(self.name) }/'
-                # link = f'<a href="{ link_url }" target="_blank">{ link_url }</a>"'
-                email = Email.objects.create(
-                    recipient_list=f'{ self.first_name } { self.last_name } <{ self.email }>',
-                    subject=texts.mail_film_still_unpaid_subject,
-                    message=Template(texts.mail_film_still_unpaid_message).render(Context(dict(film=self, link=link_url, empty="-"))),
-                    message_html=Template(texts.mail_film_still_unpaid_message_html).render(Context(dict(film=self, link=link_url, empty="-"))),
-                )
-                return int(email.sent)
-            else:
-                link_url=f'https://festivalkratasy.cz/pay-registration-fee/{ self.id }/{ slugify(self.name) }/'
-                # link = f'<a href="{ link_url }" target="_blank">{ link_url }</a>"'
-                email = Email.objects.create(
-                    recipient_list=f'{ self.first_name } { self.last_name } <{ self.email }>',
-                    subject=texts.mail_film_still_unpaid_subject_en,
-                    message=Template(texts.mail_film_still_unpaid_message_en).render(Context(dict(film=self, link=link_url, empty="-"))),
-                    message_html=Template(texts.mail_film_still_unpaid_message_html_en).render(Context(dict(film=self, link=link_url, empty="-"))),
-                )
-                return int(email.sent)
+    @classmethod
+    def update_rating(cls, film_id, count=0, like=0, technical_yes=0, technical_no=0):
+        evaluation_count = models.F('evaluation_count') + count
+        like_sum = models.F('like_sum') + like
+        cls.objects.filter(id=film_id).update(
+            evaluation_count=evaluation_count,
+            like_sum=like_sum,
+            technical_yes=models.F('technical_yes') + technical_yes,
+            technical_no=models.F('technical_no') + technical_no,
+            rating=models.ExpressionWrapper(
+                like_sum * 1.0 / models.Func(evaluation_count, models.Value(0), function='NULLIF'),
+                output_field=models.FloatField(),
+            ),
+        )
+
+    @classmethod
+    def refresh_ratings(cls, films=None):
+        films = cls.objects.all() if films is None else films
+        evaluations = Evaluation.objects.filter(film=models.OuterRef('pk')).order_by().values('film')
+        aggregate = lambda expression: models.Subquery(
+            evaluations.annotate(value=expression).values('value'), output_field=models.IntegerField())
+        films.update(
+            evaluation_count=Coalesce(aggregate(models.Count('id')), 0),
+            like_sum=Coalesce(aggregate(models.Sum('like')), 0),
+            technical_yes=Coalesce(aggregate(models.Count('id', filter=models.Q(technical=True))), 0),
+            technical_no=Coalesce(aggregate(models.Count('id', filter=models.Q(technical=False))), 0),
+        )
+        films.update(rating=models.ExpressionWrapper(
+            models.F('like_sum') * 1.0 / models.Func(models.F('evaluation_count'), models.Value(0), function='NULLIF'),
+            output_field=models.FloatField(),
+        ))
+
+    UNPAID_REMINDER = 'mail_film_still_unpaid'
+    REGISTRATION_NOTIFICATION = 'mail_film_registered_unpaid'
+
+    def get_unpaid_email(self, texts, prefix):
+        if self.country in ['CZ', 'SK']:
+            link_url = f'https://festivalkratasy.cz/zaplatit-registraci/{ self.id }/{ slugify(self.name) }/'
+            suffix = ''
         else:
-            return -1
+            link_url = f'https://festivalkratasy.cz/pay-registration-fee/{ self.id }/{ slugify(self.name) }/'
+            suffix = '_en'
+        return Email(
+            recipient_list=f'{ self.first_name } { self.last_name } <{ self.email }>',
+            subject=getattr(texts, f'{ prefix }_subject{ suffix }'),
+            message=texts.render(f'{ prefix }_message{ suffix }', film=self, link=link_url, empty="-"),
+            message_html=texts.render(f'{ prefix }_message_html{ suffix }', film=self, link=link_url, empty="-"),
+        )
+
+    def get_paid_confirmation(self, texts):
+        if self.country in ['CZ', 'SK']:
+            return Email(
+                recipient_list=f'{ self.first_name } { self.last_name } <{ self.email }>',
+                subject=texts.mail_film_paid_subject,
+                message=texts.render('mail_film_paid_message', film=self),
+                message_html=texts.render('mail_film_paid_message_html', film=self),
+            )
+        else:
+            return Email(
+                recipient_list=f'{ self.first_name } { self.last_name } <{ self.email }>',
+                subject=texts.mail_film_paid_subject_en,
+                message=texts.render('mail_film_paid_message_en', film=self),
+                message_html=texts.render('mail_film_paid_message_html_en', film=self),
+            )
+
+    def get_notification(self, texts):
+        if self.status == self.UNPAID:
+            return self.get_unpaid_email(texts, self.REGISTRATION_NOTIFICATION)
+        if self.status == self.REGISTERED:
+            return self.get_paid_confirmation(texts)
+        return None
+
+    @classmethod
+    def bulk_import(cls, films, notify=False, batch_size=500):
+        with transaction.atomic():
+            for film_id, film in zip(allocate_ids(cls, len(films)), films):
+                film.id = film_id
+            cls.objects.bulk_create(films, batch_size=batch_size)
+            emails = []
+            if notify:
+                texts = Texts.get_cached()
+                emails = [email for email in (film.get_notification(texts) for film in films) if email is not None]
+                Email.objects.bulk_create(emails, batch_size=batch_size)
+        return films, emails
 
 
 class Evaluation(models.Model):
@@ -431,6 +715,37 @@ class Evaluation(models.Model):
     def __str__(self):
         return self.get_like_display()
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if {'film_id', 'like', 'technical'} <= set(field_names):
+            instance._loaded_rating = instance.get_rating_delta()
+        return instance
+
+    def get_rating_delta(self):
+        return self.film_id, {
+            'count': 1,
+            'like': self.like,
+            'technical_yes': int(self.technical is True),
+            'technical_no': int(self.technical is False),
+        }
+
+    def save(self, *args, **kwargs):
+        loaded = getattr(self, '_loaded_rating', None)
+        with transaction.atomic():
+            if loaded is None and self.pk is not None:
+                stale_film_ids = {self.film_id, *Evaluation.objects.filter(pk=self.pk).values_list('film_id', flat=True)}
+            else:
+                stale_film_ids = None
+            super().save(*args, **kwargs)
+            if stale_film_ids:
+                Film.refresh_ratings(Film.objects.filter(id__in=stale_film_ids))
+            else:
+                if loaded is not None:
+                    Film.update_rating(loaded[0], **{k: -v for k, v in loaded[1].items()})
+                Film.update_rating(self.film_id, **self.get_rating_delta()[1])
+        self._loaded_rating = self.get_rating_delta()
+
 
 class Block(models.Model):
     name = models.CharField('název', max_length=50)
@@ -509,6 +824,7 @@ class ThepayPayment(models.Model):
         (WAITING, 'zákazník platbu provedl, ale je nutné počkat na potvrzení'),
         (CARD_DEPOSIT, 'částka je blokována na účtu zákazníka'),
     )
+    PAID_STATUSES = [OK, WAITING, CARD_DEPOSIT]
     FILM = 'f'
     TICKETS = 't'
     TYPE_CHOICES = (
@@ -539,12 +855,82 @@ class ThepayPayment(models.Model):
         if self._state.adding and self.valid_signature and self.status not in [self.CANCELED, self.ERROR]:
             if self.type == self.FILM:
                 with transaction.atomic():
+                    super().save(**kwargs)
                     self.film.status = Film.REGISTERED
                     self.film.save(update_fields=['status'])
-                    super().save(**kwargs)
         else:
             super().save(**kwargs)
 
+    @classmethod
+    def reconcile(cls, records, notify=True):
+        records = {int(record['id']): record for record in records}
+        existing = cls.objects.only('id', 'paymentId', 'status', 'film_id').in_bulk(records, field_name='paymentId')
+        statuses = dict(cls.STATUS_CHOICES)
+        changed = []
+        created = []
+        skipped = 0
+        for payment_id, record in records.items():
+            status = int(record['state'])
+            if status not in statuses:
+                skipped += 1
+                continue
+            payment = existing.get(payment_id)
+            if payment is None:
+                try:
+                    data = json.loads(record.get('merchantData') or '{}')
+                except ValueError:
+                    data = {}
+                created.append(cls(
+                    paymentId=payment_id,
+                    status=status,
+                    value=record.get('value') or 0,
+                    currency=record.get('currency') or '',
+                    methodId=record.get('methodId') or 0,
+                    merchantData=record.get('merchantData') or '',
+                    isOffline=record.get('isOffline') in ['1', 'true'] if record.get('isOffline') else None,
+                    type=list(data.keys())[0] if data else cls.FILM,
+                    film_id=data.get('f'),
+                    valid_signature=True,
+                ))
+            elif payment.status != status:
+                payment.status = status
+                changed.append(payment)
+        film_ids = {payment.film_id for payment in created if payment.film_id is not None}
+        film_ids = set(Film.objects.filter(id__in=film_ids).values_list('id', flat=True))
+        for payment in created:
+            if payment.film_id not in film_ids:
+                payment.film_id = None
+        cls.objects.bulk_create(created)
+        by_status = defaultdict(list)
+        for payment in changed:
+            by_status[payment.status].append(payment.id)
+        for status, ids in by_status.items():
+            cls.objects.filter(id__in=ids).update(status=status)
+        paid_film_ids = {payment.film_id for payment in created + changed
+                         if payment.film_id is not None and payment.status in cls.PAID_STATUSES}
+        films = Film.update_status(Film.objects.filter(id__in=paid_film_ids, status=Film.UNPAID), Film.REGISTERED, notify)
+        return len(created), len(changed), skipped, films
+
+
+class ThepayReconciliation(models.Model):
+    datetime = models.DateTimeField('datum a čas', auto_now_add=True)
+    checkpoint = models.DateTimeField('zpracováno do')
+    created = models.PositiveIntegerField('nových plateb', default=0)
+    updated = models.PositiveIntegerField('aktualizovaných plateb', default=0)
+    registered = models.PositiveIntegerField('registrovaných filmů', default=0)
+
+    class Meta:
+        verbose_name = 'synchronizace thepay plateb'
+        verbose_name_plural = 'synchronizace thepay plateb'
+        ordering = ['-checkpoint']
+
+    def __str__(self):
+        return str(self.checkpoint)
+
+    @classmethod
+    def get_checkpoint(cls):
+        return cls.objects.order_by('-checkpoint').values_list('checkpoint', flat=True).first()
+
 
 class Texts(models.Model):
     og_title = models.CharField('nadpis pro sdílení', max_length=80, null=True, blank=True)
@@ -617,6 +1003,13 @@ class Texts(models.Model):
     def __str__(self):
         return 'texty'
 
+    @classmethod
+    def get_cached(cls, *fields):
+        return caching.get_texts(cls.objects.all(), fields)
+
+    def render(self, field, **context):
+        return caching.get_texts_template(self, field).render(Context(context))
+
 
 class Email(models.Model):
     recipient_list = models.TextField('adresáti')
@@ -625,97 +1018,86 @@ class Email(models.Model):
     message_html = RichTextField('html zpráva')
     datetime = models.DateTimeField('odesláno', auto_now_add=True)
     sent = models.BooleanField('odesláno', default=False, editable=False)
+    attempts = models.PositiveSmallIntegerField('počet pokusů', default=0, editable=False)
+    next_attempt = models.DateTimeField('další pokus', null=True, blank=True, editable=False)
+    error = models.TextField('chyba', null=True, blank=True, editable=False)
 
     class Meta:
         verbose_name = 'automatický email'
         verbose_name_plural = 'automatické emaily'
+        indexes = [
+            models.Index(fields=['sent', 'next_attempt']),
+        ]
 
     def __str__(self):
         return str(self.id)
 
     def save(self, force_insert=False, force_update=False, using=None,
              update_fields=None):
-        if self._state.adding:
+        if self._state.adding and not settings.FESTIVAL_EMAIL_OUTBOX:
             self.sent = self.send()
-        super().save()
+            self.attempts = 1
+        super().save(force_insert=force_insert, force_update=force_update, using=using, update_fields=update_fields)
 
-    def send(self):
+    def send(self, connection=None, sender=None):
         recipient_list = self.recipient_list.split(',')
-        sender = Texts.objects.first().default_from_email
+        sender = sender or Texts.get_cached('default_from_email').default_from_email
         number_of_sent = send_mass_html_mail(datatuple=(
-            (self.subject, self.message, self.message_html, sender, [recipient]) for recipient in recipient_list)
+            (self.subject, self.message, self.message_html, sender, [recipient]) for recipient in recipient_list),
+            connection=connection,
         )
         return number_of_sent == len(recipient_list)
 
+    def is_queued(self):
+        return settings.FESTIVAL_EMAIL_OUTBOX and not self.sent and self.attempts < settings.FESTIVAL_EMAIL_MAX_ATTEMPTS
+
 
 @receiver(models.signals.pre_save, sender=Film)
 def send_film_paid_confirmation(sender, instance, **kwargs):
-    if instance.status == Film.REGISTERED:
-        obj = sender.objects.filter(id=instance.id).first()
-        if obj and obj.status != instance.status:
-            texts = Texts.objects.first()
-            if obj.country in ['CZ', 'SK']:
-                Email.objects.create(
-                    recipient_list=f'{ obj.first_name } { obj.last_name } <{ obj.email }>',
-                    subject=texts.mail_film_paid_subject,
-                    message=Template(texts.mail_film_paid_message).render(Context(dict(film=instance))),
-                    message_html=Template(texts.mail_film_paid_message_html).render(Context(dict(film=instance))),
-                )
-            else:
-                Email.objects.create(
-                    recipient_list=f'{ obj.first_name } { obj.last_name } <{ obj.email }>',
-                    subject=texts.mail_film_paid_subject_en,
-                    message=Template(texts.mail_film_paid_message_en).render(Context(dict(film=instance))),
-                    message_html=Template(texts.mail_film_paid_message_html_en).render(Context(dict(film=instance))),
-                )
+    if instance.status == Film.REGISTERED and instance.status_changed():
+        transaction.on_commit(instance.get_paid_confirmation(Texts.get_cached()).save)
 
 
 @receiver(models.signals.post_save, sender=Film)
 def send_film_registration_notification(sender, instance, **kwargs):
     if kwargs['created'] and instance.status == sender.UNPAID:
-        texts = Texts.objects.first()
-        if instance.country in ['CZ', 'SK']:
-            link_url=f'https://festivalkratasy.cz/zaplatit-registraci/{ instance.id }/{ slugify(instance.name) }/'
-            # link = f'<a href="{ link_url }" target="_blank">{ link_url }</a>"'
-            Email.objects.create(
-                recipient_list=f'{ instance.first_name } { instance.last_name } <{ instance.email }>',
-                subject=texts.mail_film_registered_unpaid_subject,
-                message=Template(texts.mail_film_registered_unpaid_message).render(Context(dict(film=instance, link=link_url, empty="-"))),
-                message_html=Template(texts.mail_film_registered_unpaid_message_html).render(Context(dict(film=instance, link=link_url, empty="-"))),
-            )
-        else:
-            link_url=f'https://festivalkratasy.cz/pay-registration-fee/{ instance.id }/{ slugify(instance.name) }/'
-            # link = f'<a href="{ link_url }" target="_blank">{ link_url }</a>"'
-            Email.objects.create(
-                recipient_list=f'{ instance.first_name } { instance.last_name } <{ instance.email }>',
-                subject=texts.mail_film_registered_unpaid_subject_en,
-                message=Template(texts.mail_film_registered_unpaid_message_en).render(Context(dict(film=instance, link=link_url, empty="-"))),
-                message_html=Template(texts.mail_film_registered_unpaid_message_html_en).render(Context(dict(film=instance, link=link_url, empty="-"))),
-            )
+        instance.get_unpaid_email(Texts.get_cached(), sender.REGISTRATION_NOTIFICATION).save()
 
 
 @receiver(models.signals.post_save, sender=ThepayPayment)
 def send_film_unpaid_notification(sender, instance, **kwargs):
     if kwargs['created'] and instance.status in [sender.CANCELED, sender.ERROR] and instance.film is not None:
-        texts = Texts.objects.first()
+        texts = Texts.get_cached()
         if instance.film.country in ['CZ', 'SK']:
             link_url=f'https://festivalkratasy.cz/opakovat-platbu/{ instance.paymentId }/'
             # link = f'<a href="{ link_url }" target="_blank">{ link_url }</a>"'
-            Email.objects.create(
+            email = Email(
                 recipient_list=f'{ instance.film.first_name } { instance.film.last_name } <{ instance.film.email }>',
                 subject=texts.mail_film_unpaid_subject,
-                message=Template(texts.mail_film_unpaid_message).render(Context(dict(film=instance.film, link=link_url))),
-                message_html=Template(texts.mail_film_unpaid_message_html).render(Context(dict(film=instance.film, link=link_url))),
+                message=texts.render('mail_film_unpaid_message', film=instance.film, link=link_url),
+                message_html=texts.render('mail_film_unpaid_message_html', film=instance.film, link=link_url),
             )
         else:
             link_url=f'https://festivalkratasy.cz/repeat-payment/{ instance.paymentId }/'
             # link = f'<a href="{ link_url }" target="_blank">{ link_url }</a>"'
-            Email.objects.create(
+            email = Email(
                 recipient_list=f'{ instance.film.first_name } { instance.film.last_name } <{ instance.film.email }>',
                 subject=texts.mail_film_unpaid_subject_en,
-                message=Template(texts.mail_film_unpaid_message_en).render(Context(dict(film=instance.film, link=link_url))),
-                message_html=Template(texts.mail_film_unpaid_message_html_en).render(Context(dict(film=instance.film, link=link_url))),
+                message=texts.render('mail_film_unpaid_message_en', film=instance.film, link=link_url),
+                message_html=texts.render('mail_film_unpaid_message_html_en', film=instance.film, link=link_url),
             )
+        transaction.on_commit(email.save)
+
+
+@receiver(models.signals.post_delete, sender=Evaluation)
+def update_film_rating(sender, instance, **kwargs):
+    film_id, delta = getattr(instance, '_loaded_rating', None) or instance.get_rating_delta()
+    Film.update_rating(film_id, **{k: -v for k, v in delta.items()})
+
+
+@receiver(models.signals.post_delete, sender=Photo)
+def refresh_photo_gallery(sender, instance, **kwargs):
+    sender.refresh_gallery(instance.year_id)
 
 
 @receiver(models.signals.post_delete, sender=Photo)
@@ -724,6 +1106,36 @@ def remove_photo_file(sender, instance, **kwargs):
     os.remove(f'{ settings.BASE_DIR }{ instance.cropped.url } ')
 
 
+def invalidate_section_list_cache(sender, **kwargs):
+    caching.invalidate_section_list()
+
+
+for section_list_model in [Section, Sponsor, Contact, PressRelease, Article, Photo, Year, Gallery]:
+    models.signals.post_save.connect(invalidate_section_list_cache, sender=section_list_model)
+    models.signals.post_delete.connect(invalidate_section_list_cache, sender=section_list_model)
+models.signals.m2m_changed.connect(invalidate_section_list_cache, sender=Sponsor.year.through)
+
+
+@receiver(models.signals.post_delete, sender=Year)
+@receiver(models.signals.post_delete, sender=Gallery)
+def invalidate_current_year_cache(sender, **kwargs):
+    caching.invalidate_current_year()
+
+
+@receiver(models.signals.post_save, sender=Year)
+@receiver(models.signals.post_save, sender=Gallery)
+@receiver(models.signals.post_delete, sender=Year)
+@receiver(models.signals.post_delete, sender=Gallery)
+def invalidate_years_cache(sender, **kwargs):
+    caching.invalidate_years()
+
+
+@receiver(models.signals.post_save, sender=Texts)
+@receiver(models.signals.post_delete, sender=Texts)
+def invalidate_texts_cache(sender, **kwargs):
+    caching.invalidate_texts()
+
+
 class ThepayPaymentForm(ModelForm):
 
     class Meta:
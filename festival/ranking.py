@@ -0,0 +1,96 @@
+import math
+from collections import defaultdict, namedtuple
+
+from . import models
+
+
+Z_95 = 1.96
+
+FilmScore = namedtuple('FilmScore', [
+    'film_id', 'name', 'category', 'genre', 'status', 'evaluations', 'rating',
+    'score', 'low', 'high', 'rank', 'category_rank', 'genre_rank',
+])
+
+CSV_HEADER = [
+    'id', 'název', 'kategorie', 'žánr', 'status', 'počet hodnocení', 'průměrné hodnocení',
+    'normalizované skóre', 'dolní mez', 'horní mez', 'pořadí', 'pořadí v kategorii', 'pořadí v žánru',
+]
+
+
+def load(evaluations=None):
+    evaluations = models.Evaluation.objects.all() if evaluations is None else evaluations
+    rows = list(evaluations.order_by().values_list(
+        'user_id', 'film_id', 'like', 'film__name', 'film__category', 'film__genre', 'film__status'))
+    if not rows:
+        return [], [], [], {}
+    users, films, likes, names, categories, genres, statuses = zip(*rows)
+    info = {film_id: (name, category, genre, status)
+            for film_id, name, category, genre, status in zip(films, names, categories, genres, statuses)}
+    return users, films, likes, info
+
+
+def mean_std(values):
+    n = len(values)
+    mean = sum(values) / n
+    return mean, math.sqrt(sum((value - mean) ** 2 for value in values) / n)
+
+
+def normalize(users, likes):
+    by_user = defaultdict(list)
+    for user, like in zip(users, likes):
+        by_user[user].append(like)
+    scales = {user: mean_std(values) for user, values in by_user.items()}
+    return [(like - scales[user][0]) / scales[user][1] if scales[user][1] else 0.0
+            for user, like in zip(users, likes)]
+
+
+def rank_within(scores, key):
+    ranks = {}
+    counters = defaultdict(int)
+    for film_id, group in sorted(((film_id, key(film_id)) for film_id in scores), key=lambda item: -scores[item[0]]):
+        counters[group] += 1
+        ranks[film_id] = counters[group]
+    return ranks
+
+
+def get_ranking(evaluations=None, status=None):
+    users, films, likes, info = load(evaluations)
+    by_film = defaultdict(list)
+    raw = defaultdict(list)
+    for film_id, like, score in zip(films, likes, normalize(users, likes)):
+        if status and info[film_id][3] != status:
+            continue
+        by_film[film_id].append(score)
+        raw[film_id].append(like)
+    scores = {}
+    intervals = {}
+    for film_id, values in by_film.items():
+        n = len(values)
+        mean = sum(values) / n
+        scores[film_id] = mean
+        if n > 1:
+            half = Z_95 * math.sqrt(sum((value - mean) ** 2 for value in values) / (n - 1) / n)
+            intervals[film_id] = (mean - half, mean + half)
+        else:
+            intervals[film_id] = (None, None)
+    ranks = rank_within(scores, lambda film_id: None)
+    category_ranks = rank_within(scores, lambda film_id: info[film_id][1])
+    genre_ranks = rank_within(scores, lambda film_id: info[film_id][2])
+    return [
+        FilmScore(
+            film_id, *info[film_id], len(raw[film_id]), sum(raw[film_id]) / len(raw[film_id]),
+            scores[film_id], *intervals[film_id], ranks[film_id], category_ranks[film_id], genre_ranks[film_id],
+        )
+        for film_id in sorted(scores, key=ranks.get)
+    ]
+
+
+def to_row(score):
+    round_ = lambda value: None if value is None else round(value, 3)
+    return [
+        score.film_id, score.name, dict(models.Film.CATEGORY_CHOICES).get(score.category),
+        dict(models.Film.GENRE_CHOICES).get(score.genre), dict(models.Film.STATUS_CHOICES).get(score.status),
+        score.evaluations,
+        round_(score.rating), round_(score.score), round_(score.low), round_(score.high),
+        score.rank, score.category_rank, score.genre_rank,
+    ]
@@ -20,9 +20,7 @@ $(function () {
     });
     $('form').submit(function () {
         if ($('#cropper').css('display')!=='none') {
-            $('#cropper').croppie('result', {}).then(function (croppedData) {
-                $('#id_cropped').val(croppedData);
-            });
+            $('#id_cropped').val($('#cropper').croppie('get').points.join(','));
         }
         return true;
     });
@@ -1,5 +1,8 @@
 import re
 from django import template
+from django.utils.html import format_html, format_html_join
+
+from festival.models import WEBP_SUPPORTED
 
 
 register = template.Library()
@@ -14,3 +17,16 @@ def add_nbsps(value):
 def tp_escape(value):
     value = re.sub(r'/', '\/', value)
     return re.sub(r'&', '\u0026', value)
+
+
+@register.simple_tag(name='photo_picture')
+def photo_picture(photo, sizes='100vw', alt=''):
+    sources = format_html_join('', '<source type="{}" srcset="{}" sizes="{}">',
+                               ((type, srcset, sizes) for type, srcset in photo.get_sources()))
+    return format_html('<picture>{}<img src="{}" srcset="{}" sizes="{}" alt="{}"></picture>',
+                       sources, photo.large.url, photo.get_srcset(), sizes, alt)
+
+
+@register.simple_tag(name='webp_supported')
+def webp_supported():
+    return WEBP_SUPPORTED
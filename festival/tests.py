@@ -0,0 +1,156 @@
+import threading
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from io import StringIO
+
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from . import models
+from .admin import FilmResource
+
+
+def create_film(i, **kwargs):
+    return models.Film.objects.create(
+        first_name='Jan', last_name=str(i), email=f'film{ i }@example.com', production='produkce',
+        country='CZ', name=f'film { i }', time=timedelta(minutes=5), description='popis', year=2020,
+        category=models.Film.FILM, genre=models.Film.DRAMA, film_url='https://example.com/film',
+        subtitles_url='https://example.com/titulky', **kwargs
+    )
+
+
+class ChangeListQueryBudgetTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        cls.year = models.Year.objects.create(vol=1, date_start=date(2020, 6, 1), date_end=date(2020, 6, 3), current=True)
+        models.Texts.objects.create()
+
+    def setUp(self):
+        self.client.force_login(self.user)
+        self.rows = 0
+
+    def add_rows(self, count):
+        for i in range(self.rows, self.rows + count):
+            film = create_film(i)
+            models.Evaluation.objects.create(user=self.user, film=film, like=3, verbal='hodnocení')
+            models.ThepayPayment.objects.create(
+                value=100, currency='CZK', methodId=21, merchantData='{}', paymentId=i + 1,
+                status=models.ThepayPayment.OK, type=models.ThepayPayment.FILM, valid_signature=True, film=film,
+            )
+            photo = models.Photo.objects.create(description=f'fotka { i }', year=self.year)
+            models.Article.objects.create(
+                headline=f'článek { i }', headline_en=f'article { i }', full_text='text' * 100, full_text_en='text' * 100,
+                date=date(2020, 1, 1), short_text='úryvek', short_text_en='excerpt', photo=photo,
+            )
+            models.Section.objects.create(headline=f'sekce { i }', headline_en=f'section { i }', full_text='text' * 100)
+            models.PressRelease.objects.create(name=f'tiskovka { i }', file='tiskovky/tiskovka.pdf', year=self.year)
+        self.rows += count
+
+    def get_changelist_urls(self):
+        return [reverse(f'admin:{ model._meta.app_label }_{ model._meta.model_name }_changelist')
+                for model in admin.site._registry if model._meta.app_label == 'festival']
+
+    def count_queries(self, url):
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, url)
+        return len(queries)
+
+    def test_changelist_queries_do_not_grow_with_rows(self):
+        urls = self.get_changelist_urls()
+        self.add_rows(3)
+        budgets = {url: self.count_queries(url) for url in urls}
+        self.add_rows(20)
+        for url in urls:
+            with self.subTest(url=url):
+                self.client.get(url)
+                with self.assertNumQueries(budgets[url]):
+                    self.client.get(url)
+
+
+class FilmRatingTest(TestCase):
+    def setUp(self):
+        models.Texts.objects.create()
+        self.user = User.objects.create_user('juror')
+
+    def test_save_keeps_aggregates_written_meanwhile(self):
+        film = create_film(0)
+        stale = models.Film.objects.get(id=film.id)
+        models.Evaluation.objects.create(user=self.user, film=film, like=4, verbal='hodnocení', technical=True)
+        stale.name = 'nový název'
+        stale.save()
+        film.refresh_from_db()
+        self.assertEqual((film.name, film.evaluation_count, film.rating, film.technical_yes), ('nový název', 1, 4.0, 1))
+
+    def test_resource_skips_aggregates(self):
+        create_film(0)
+        self.assertFalse(set(models.Film.RATING_FIELDS) & set(FilmResource().export().headers))
+
+
+class DataApiStubHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        payments = ''.join(
+            f'<payment><id>{ payment_id }</id><state>{ state }</state><value>100.00</value><currency>CZK</currency>'
+            f'<methodId>21</methodId><merchantData>{{"f":{ film_id }}}</merchantData></payment>'
+            for payment_id, state, film_id in self.server.payments
+        )
+        body = (
+            '<?xml version="1.0"?><SOAP-ENV:Envelope xmlns:SOAP-ENV="http://schemas.xmlsoap.org/soap/envelope/" '
+            'xmlns:ns1="https://www.thepay.cz/api/data/"><SOAP-ENV:Body><ns1:getPaymentsResponse>'
+            f'<ns1:payments>{ payments }</ns1:payments>'
+            '<ns1:pagination><ns1:page>1</ns1:page><ns1:totalPages>1</ns1:totalPages></ns1:pagination>'
+            '</ns1:getPaymentsResponse></SOAP-ENV:Body></SOAP-ENV:Envelope>'
+        )
+        self.send_response(200)
+        self.end_headers()
+        self.wfile.write(body.encode())
+
+    def log_message(self, *args):
+        pass
+
+
+class ReconcilePaymentsTest(TransactionTestCase):
+    def setUp(self):
+        models.Texts.objects.create()
+        self.server = HTTPServer(('127.0.0.1', 0), DataApiStubHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f'http://127.0.0.1:{ self.server.server_address[1] }/'
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_only_paid_states_register_films(self):
+        states = [2, 7, 9, 3, 4, 6, 1]
+        films = [create_film(i) for i in range(len(states))]
+        self.server.payments = [(1000 + i, state, film.id) for i, (state, film) in enumerate(zip(states, films))]
+        mail.outbox = []
+        call_command('reconcile_payments', url=self.url, stdout=StringIO())
+        statuses = dict(models.Film.objects.values_list('id', 'status'))
+        self.assertEqual([statuses[film.id] for film in films], [models.Film.REGISTERED] * 3 + [models.Film.UNPAID] * 4)
+        self.assertEqual(sorted(models.ThepayPayment.objects.values_list('status', flat=True)), [2, 3, 4, 6, 7, 9])
+        self.assertEqual(len(mail.outbox), 3)
+
+    def test_status_change_registers_film_once(self):
+        film = create_film(0)
+        self.server.payments = [(1000, models.ThepayPayment.CANCELED, film.id)]
+        call_command('reconcile_payments', url=self.url, stdout=StringIO())
+        film.refresh_from_db()
+        self.assertEqual(film.status, models.Film.UNPAID)
+        self.server.payments = [(1000, models.ThepayPayment.OK, film.id)]
+        mail.outbox = []
+        call_command('reconcile_payments', url=self.url, stdout=StringIO())
+        call_command('reconcile_payments', url=self.url, stdout=StringIO())
+        film.refresh_from_db()
+        self.assertEqual(film.status, models.Film.REGISTERED)
+        self.assertEqual(models.ThepayPayment.objects.get(paymentId=1000).status, models.ThepayPayment.OK)
+        self.assertEqual(len(mail.outbox), 1)
@@ -1,14 +1,27 @@
 import time, json
 
-from hashlib import md5
+from functools import lru_cache
+from hashlib import md5, sha256
 from urllib.parse import urlencode
+from urllib.request import Request, urlopen
+from xml.etree import ElementTree
 from django.conf import settings
 
 
-class PaymentMixin:
-    eet_dph = {}
-    params = {}
+def sign(items, password):
+    qs = ''
+    for k, v in items:
+        qs += f'{ k }={ v }&'
+    qs += f'password={ password }'
+    return md5(qs.encode('utf-8')).hexdigest()
+
+
+@lru_cache(maxsize=1024)
+def get_signed_query_string(items, password, extra=()):
+    return urlencode(items + (('signature', sign(items, password)),) + extra)
 
+
+class PaymentMixin:
     def get_params(self):
         params = {k: v for k, v in self.params.items() if v is not None}
         if params.get('deposit') is not None:
@@ -21,13 +34,12 @@ class PaymentMixin:
 
     def get_signed_params(self):
         params = self.get_params()
-        qs = ''
-        for k, v in params.items():
-            qs += f'{ k }={ v }&'
-        qs += f'password={ settings.TP_PASSWORD }'
-        params['signature'] = md5(qs.encode('utf-8')).hexdigest()
+        params['signature'] = sign(tuple(params.items()), settings.TP_PASSWORD)
         return params
 
+    def get_signed_query_string(self, **kwargs):
+        return get_signed_query_string(tuple(self.get_params().items()), settings.TP_PASSWORD, tuple(kwargs.items()))
+
 
 class Payment(PaymentMixin):
     def __init__(self,
@@ -42,7 +54,7 @@ class Payment(PaymentMixin):
                  specific_symbol=None,
                  deposit=None,
                  is_recurring=None,
-                 eet_dph={},
+                 eet_dph=None,
                  ):
         self.params = {
             'merchantId' : settings.TP_MERCHANT_ID,
@@ -58,7 +70,7 @@ class Payment(PaymentMixin):
             'specificSymbol': specific_symbol,
             'deposit': deposit,
             'isRecurring': is_recurring}
-        self.eet_dph = eet_dph
+        self.eet_dph = eet_dph or {}
 
     def get_params(self):
         params = super().get_params()
@@ -90,12 +102,10 @@ class ReturnedPayment(PaymentMixin):
             'isConfirm': GET.get('isConfirm'),
             'customerAccountNumber': GET.get('customerAccountNumber'),
             'customerAccountName': GET.get('customerAccountName'),}
+        self.eet_dph = {}
         self.signature = GET.get('signature')
         self.data = json.loads(self.params['merchantData'])
 
-    signature = None
-    data = {}
-
     def signature_is_valid(self):
         signature = self.get_signed_params().get('signature')
         if self.signature and self.signature == signature:
@@ -110,47 +120,149 @@ class ReturnedPayment(PaymentMixin):
 
 
 class AbstractHelper:
+    helper_template_name = None
+
     def __init__(self, payment):
         self.payment = payment
 
-    payment = None
-    context = {}
-
     def get_context(self):
-        context = self.context
-        context.update({
+        return {
+            'helper_template_name': self.helper_template_name,
             'query_string': self.get_query_string(),
-        })
-        return context
+        }
 
     def get_query_string(self, **kwargs):
-        params = self.payment.get_signed_params()
-        params.update(kwargs)
-        return urlencode(params)
+        return self.payment.get_signed_query_string(**kwargs)
 
 
 class DivHelper(AbstractHelper):
+    helper_template_name = 'festival/helpers/tp_div_helper.html'
+
     def __init__(self, payment,
-                 gate_url=settings.TP_GATE_URL,
+                 gate_url=None,
                  skin=None,
                  disable_button_css=False,
                  disable_popup_css=False):
         super().__init__(payment)
-        self.context.update({
-            'gate_url': gate_url,
-            'skin': skin,
-            'disable_button_css': disable_button_css,
-            'disable_popup_css': disable_popup_css,
-            'time': int(time.time()),
-        })
+        self.gate_url = gate_url or settings.TP_GATE_URL
+        self.skin = skin
+        self.disable_button_css = disable_button_css
+        self.disable_popup_css = disable_popup_css
+        self.time = int(time.time())
 
-    context = {
-        'helper_template_name': 'festival/helpers/tp_div_helper.html'
-    }
+    def get_context(self):
+        context = super().get_context()
+        context.update({
+            'gate_url': self.gate_url,
+            'skin': self.skin,
+            'disable_button_css': self.disable_button_css,
+            'disable_popup_css': self.disable_popup_css,
+            'time': self.time,
+        })
+        return context
 
     def get_query_string(self):
-        helper_params = {
-            'disableButtonCss': str(self.context['disable_button_css']).lower(),
-            'disablePopupCss': str(self.context['disable_popup_css']).lower(),
-        }
-        return super().get_query_string(**helper_params)
+        return super().get_query_string(
+            disableButtonCss=str(self.disable_button_css).lower(),
+            disablePopupCss=str(self.disable_popup_css).lower(),
+        )
+
+
+class DataApiError(Exception):
+    pass
+
+
+class DataApi:
+    namespace = 'https://www.thepay.cz/api/data/'
+    soap_namespace = 'http://schemas.xmlsoap.org/soap/envelope/'
+
+    def __init__(self, url=None, merchant_id=None, account_id=None, password=None, timeout=30):
+        self.url = url or settings.TP_DATA_API_URL
+        self.merchant_id = merchant_id or settings.TP_MERCHANT_ID
+        self.account_id = account_id or settings.TP_ACCOUNT_ID
+        self.password = password or settings.TP_DATA_API_PASWORD
+        self.timeout = timeout
+
+    def flatten(self, params, prefix=''):
+        items = []
+        for k, v in params.items():
+            key = f'{ prefix }.{ k }' if prefix else k
+            if isinstance(v, dict):
+                items += self.flatten(v, key)
+            elif v is not None:
+                items.append((key, v))
+        return items
+
+    def sign(self, params):
+        qs = ''.join(f'{ k }={ v }&' for k, v in self.flatten(params))
+        qs += f'password={ self.password }'
+        return sha256(qs.encode('utf-8')).hexdigest()
+
+    def build_element(self, parent, params):
+        for k, v in params.items():
+            if v is None:
+                continue
+            element = ElementTree.SubElement(parent, k)
+            if isinstance(v, dict):
+                self.build_element(element, v)
+            else:
+                element.text = str(v)
+
+    def call(self, operation, params):
+        params = dict({'merchantId': self.merchant_id}, **params)
+        params['signature'] = self.sign(params)
+        envelope = ElementTree.Element(f'{{{ self.soap_namespace }}}Envelope')
+        body = ElementTree.SubElement(envelope, f'{{{ self.soap_namespace }}}Body')
+        self.build_element(ElementTree.SubElement(body, f'{{{ self.namespace }}}{ operation }Request'), params)
+        request = Request(self.url, data=ElementTree.tostring(envelope, encoding='utf-8'), headers={
+            'Content-Type': 'text/xml; charset=utf-8',
+            'SOAPAction': f'{ self.namespace }{ operation }',
+        })
+        try:
+            with urlopen(request, timeout=self.timeout) as response:
+                root = ElementTree.fromstring(response.read())
+        except (OSError, ElementTree.ParseError) as e:
+            raise DataApiError(e) from e
+        fault = self.find(root, 'Fault')
+        if fault is not None:
+            raise DataApiError(self.find(fault, 'faultstring').text)
+        return root
+
+    def find(self, element, name):
+        for child in element.iter():
+            if child.tag.split('}')[-1] == name:
+                return child
+        return None
+
+    def to_dict(self, element):
+        return {child.tag.split('}')[-1]: child.text for child in element}
+
+    def get_payments(self, finished_on_from=None, finished_on_to=None, page=1, records_on_page=100):
+        root = self.call('getPayments', {
+            'searchParams': {
+                'accountId': self.account_id,
+                'finishedOnFrom': finished_on_from and finished_on_from.isoformat(),
+                'finishedOnTo': finished_on_to and finished_on_to.isoformat(),
+            },
+            'pagination': {
+                'page': page,
+                'recordsOnPage': records_on_page,
+            },
+            'ordering': {
+                'orderBy': 'finishedOn',
+                'orderHow': 'ASC',
+            },
+        })
+        payments = self.find(root, 'payments')
+        total_pages = self.find(root, 'totalPages')
+        return (
+            [self.to_dict(payment) for payment in payments] if payments is not None else [],
+            int(total_pages.text) if total_pages is not None else page,
+        )
+
+    def iter_payments(self, finished_on_from=None, finished_on_to=None, records_on_page=100):
+        page, total_pages = 1, 1
+        while page <= total_pages:
+            payments, total_pages = self.get_payments(finished_on_from, finished_on_to, page, records_on_page)
+            yield payments
+            page += 1
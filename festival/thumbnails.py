@@ -0,0 +1,68 @@
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+
+from imagekit.cachefiles import ImageCacheFile
+from imagekit.registry import generator_registry
+
+from . import models
+
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_generator_ids():
+    return [generator_id for generator_id in generator_registry.get_ids() if generator_id.startswith('festival:')]
+
+
+def get_job(photo):
+    return photo.id, photo.original.name, photo.width, photo.height
+
+
+def generate(photo_id, original, width, height):
+    photo = models.Photo(id=photo_id, original=original, width=width, height=height)
+    for generator_id in get_generator_ids():
+        ImageCacheFile(generator_registry.get(generator_id, source=photo.original)).generate()
+    return photo_id
+
+
+def get_executor(reset=False):
+    global _executor
+    with _executor_lock:
+        if _executor is None or reset:
+            _executor = ProcessPoolExecutor(max_workers=settings.FESTIVAL_THUMBNAIL_WORKERS)
+        return _executor
+
+
+def log_failure(photo_id):
+    def callback(future):
+        exception = future.exception()
+        if exception is not None:
+            logger.error(f'Generování náhledů fotky { photo_id } selhalo.',
+                         exc_info=(type(exception), exception, exception.__traceback__))
+    return callback
+
+
+def submit(executor, jobs):
+    futures = []
+    for job in jobs:
+        future = executor.submit(generate, *job)
+        future.add_done_callback(log_failure(job[0]))
+        futures.append(future)
+    return futures
+
+
+def generate_async(photos):
+    jobs = [get_job(photo) for photo in photos if photo.original]
+    if not settings.FESTIVAL_THUMBNAIL_WORKERS:
+        return [generate(*job) for job in jobs]
+    try:
+        return submit(get_executor(), jobs)
+    except BrokenProcessPool:
+        return submit(get_executor(reset=True), jobs)
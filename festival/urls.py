@@ -28,6 +28,7 @@ urlpatterns = [
     path(_('zasady-zpracovani-osobnich-udaju/'), views.TextView.as_view(), {'text': 'gdpr'}),
     path('thepay-payment-done/', views.PaymentCreateView.as_view()),
     path('ajax/film-registration/', views.FilmRegistrationView.as_view()),
+    path('ajax/gallery/<int:pk>/', views.PhotoPageView.as_view()),
     path('admin/', admin.site.urls),
 ]
 
@@ -1,12 +1,13 @@
 import json
 
-from django.http import Http404
+from django.db import IntegrityError, transaction
+from django.http import Http404, HttpResponse, HttpResponseRedirect
 from django.shortcuts import redirect, reverse
 from django.views.generic import CreateView, DetailView, ListView, TemplateView, UpdateView
 from django.utils.text import slugify
 from django.utils.translation import gettext_lazy as _
 
-from . import models, the_pay
+from . import caching, models, the_pay
 
 
 class NavContextMixin:
@@ -50,19 +51,48 @@ class SectionListView(NavContextMixin, ListView):
 
     def get(self, request, *args, **kwargs):
         self.role = kwargs.get('role', None)
-        if self.role:
+        if self.role and request.session.get('FESTIVAL_ROLE') != self.role:
             request.session['FESTIVAL_ROLE'] = self.role
         self.first_time = bool(request.GET.get('first', 0))
         self.home = bool(request.GET.get('home', 0))
-        return super().get(request, *args, **kwargs)
+        cache_key = caching.get_section_list_key(self.role, request.LANGUAGE_CODE, request.user.is_staff,
+                                                 self.first_time, self.home, request.GET.get('nav', 0))
+        content = caching.get_section_list(cache_key)
+        if content is not None:
+            return HttpResponse(content)
+        response = super().get(request, *args, **kwargs)
+        response.add_post_render_callback(lambda r: caching.set_section_list(cache_key, r.content))
+        return response
 
 
 class PhotoListView(NavContextMixin, ListView):
     model = models.Photo
+    page_size = 24
+
+    def get_queryset(self):
+        return models.Photo.objects.filter(year__isnull=False, gallery_position__lte=self.page_size).select_related('year')
+
+
+class PhotoPageView(ListView):
+    model = models.Photo
+    page_size = PhotoListView.page_size
+    template_name = 'festival/photo_page.html'
+
+    def get_queryset(self):
+        try:
+            after = int(self.request.GET.get('after', 0))
+        except ValueError:
+            raise Http404(_('Page not found'))
+        return models.Photo.objects.filter(
+            year_id=self.kwargs['pk'],
+            gallery_position__gt=after,
+            gallery_position__lte=after + self.page_size,
+        ).select_related('year').order_by('gallery_position')
 
 
 class PhotoDetailView(NavContextMixin, DetailView):
     model = models.Photo
+    queryset = models.Photo.objects.select_related('year')
 
     def get_context_data(self, *args, **kwargs):
         context_data = super().get_context_data()
@@ -124,7 +154,7 @@ class FilmRegistrationView(UpdateView):
         helper = the_pay.DivHelper(payment=payment)
         self.template_name = self.pay_template_name
         context = helper.get_context()
-        context['texts'] = models.Texts.objects.first()
+        context['texts'] = models.Texts.get_cached('method_select_film', 'method_select_film_en')
         return self.render_to_response(context)
 
 
@@ -144,9 +174,7 @@ class RepeatPaymentView(NavContextMixin, DetailView):
             raise Http404(_('Page not found'))
         film_id = json.loads(obj.merchantData).get('f')
         if film_id is not None and models.ThepayPayment.objects.filter(
-                film_id=film_id, status__in=[models.ThepayPayment.OK,
-                                             models.ThepayPayment.WAITING,
-                                             models.ThepayPayment.CARD_DEPOSIT]).exists():
+                film_id=film_id, status__in=models.ThepayPayment.PAID_STATUSES).exists():
             raise Http404(_('Page not found'))
         return obj
 
@@ -239,8 +267,18 @@ class PaymentCreateView(CreateView):
                 if unpaid_ids and unpaid_ids == self.initial['tickets']:
                     request.session.pop('UNPAID_TICKETS')
         request.session['THEPAY_PAYMENT'] = payment.to_JSON()
+        known_payment = self.get_known_payment(payment.params.get('paymentId'))
+        if known_payment is not None:
+            return HttpResponseRedirect(self.success_urls[known_payment.type])
         return self.post(request, *args, **kwargs)
 
+    def get_known_payment(self, payment_id):
+        try:
+            payment_id = int(payment_id)
+        except (TypeError, ValueError):
+            return None
+        return models.ThepayPayment.objects.filter(paymentId=payment_id).only('type').first()
+
     def get_form_kwargs(self):
         kwargs = {
             'initial': self.get_initial(),
@@ -260,6 +298,22 @@ class PaymentCreateView(CreateView):
         form.fields['type'].disabled = True
         return form
 
+    def form_valid(self, form):
+        try:
+            with transaction.atomic():
+                self.object = form.save()
+        except IntegrityError:
+            self.object = self.get_known_payment(form.cleaned_data.get('paymentId'))
+            if self.object is None:
+                raise
+        return HttpResponseRedirect(self.get_success_url())
+
+    def form_invalid(self, form):
+        known_payment = self.get_known_payment(self.request.GET.get('paymentId'))
+        if known_payment is not None:
+            return HttpResponseRedirect(self.success_urls[known_payment.type])
+        return super().form_invalid(form)
+
     def get_success_url(self):
         return self.success_urls[self.object.type]
 
@@ -273,7 +327,7 @@ class TextView(NavContextMixin, TemplateView):
     def get_context_data(self, **kwargs):
         self.text = kwargs.get('text')
         context_data = super().get_context_data(**kwargs)
-        context_data['texts'] = models.Texts.objects.first()
+        context_data['texts'] = models.Texts.get_cached(self.text, f'{ self.text }_en')
         return context_data
 
     def get_template_names(self):
@@ -123,11 +123,15 @@ CKEDITOR_CONFIGS = {
 
 LOGIN_URL = '/admin/login'
 
+FESTIVAL_CACHE_TIMEOUT = int(os.environ.get('FESTIVAL_CACHE_TIMEOUT', 60 * 10))
+FESTIVAL_THUMBNAIL_WORKERS = int(os.environ.get('FESTIVAL_THUMBNAIL_WORKERS', 2))
+
 TP_MERCHANT_ID = os.environ.get('TP_MERCHANT_ID', 1)
 TP_ACCOUNT_ID = os.environ.get('TP_ACCOUNT_ID', 1)
 TP_PASSWORD = os.environ.get('TP_PASSWORD', 'my$up3rsecr3tp4$$word')
 TP_GATE_URL = os.environ.get('TP_GATE_URL', 'https://www.thepay.cz/demo-gate/')
 TP_DATA_API_PASWORD = os.environ.get('TP_DATA_API_PASWORD', 'my$up3rsecr3tp4$$word')
+TP_DATA_API_URL = os.environ.get('TP_DATA_API_URL', 'https://www.thepay.cz/demo-gate/api/data.php')
 
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
 EMAIL_USE_TLS = False
@@ -136,6 +140,14 @@ EMAIL_HOST_USER = os.environ.get('EMAIL_HOST_USER', 'email_host_user')
 EMAIL_HOST_PASSWORD = os.environ.get('EMAIL_HOST_PASSWORD', 'email_host_password')
 EMAIL_PORT = 25
 
+FESTIVAL_EMAIL_OUTBOX = bool(int(os.environ.get('FESTIVAL_EMAIL_OUTBOX', 0)))
+FESTIVAL_EMAIL_MAX_ATTEMPTS = 5
+FESTIVAL_EMAIL_BATCH_SIZE = 50
+FESTIVAL_EMAIL_RATE = float(os.environ.get('FESTIVAL_EMAIL_RATE', 0))
+FESTIVAL_EMAIL_POOL_SIZE = 2
+FESTIVAL_EMAIL_POOL_MAX_IDLE = 30
+FESTIVAL_EMAIL_POOL_MAX_MESSAGES = 100
+
 CKEDITOR_CONFIGS = {
     'default': {
         'toolbar': 'Custom',